@@ -0,0 +1,140 @@
+# Написано на python 3.7
+# Замер скорости эмуляции (шагов в секунду) на примерах asm1.txt - asm3.txt
+import sys  # библиотека, необходимая для обработки параметров командной строки
+import os
+import time
+import tempfile
+import random
+import asyncio
+import tracemalloc
+from emulator import CmdProcessor, MachineProfile
+from benchmarks.workloads import LARGE_PROFILE, generate_source, max_source  # генераторы программ для замеров
+
+
+def run_steps(proc, data):
+    '''выполнение программы с начала до останова, возвращает количество выполненных шагов'''
+    proc.proc.init_dmem(data)
+    proc.proc.pc = 0
+    proc.proc.halt = False
+    return proc.run(trace=None)
+
+
+def bench_file(filename, predecode, storage='bytes', repeat=2000):
+    '''замер количества шагов в секунду для программы из файла filename'''
+    proc = CmdProcessor(predecode=predecode, storage=storage, output=[])
+    proc.open_asm_file(filename)
+    data = proc.proc.values(proc.proc.dmem)  # исходная память данных
+    steps = 0
+    start = time.perf_counter()
+    for idx in range(repeat):
+        steps += run_steps(proc, data)
+    elapsed = time.perf_counter() - start
+    return steps / elapsed
+
+
+def bench_kernel(size, engine='interp', seed=0):
+    '''замер поиска максимума в массиве из size ячеек, возвращает (шагов в секунду, результат)'''
+    cpu_class = CmdProcessor
+    if engine == 'block':
+        from jit import BlockCmdProcessor
+        cpu_class = BlockCmdProcessor
+    out = []
+    cpu = cpu_class(storage='array', output=out, profile=MachineProfile(dmem_size=size + 2))
+    rng = random.Random(seed)
+    data = [rng.randrange(-2 ** 31, 2 ** 31) for idx in range(size)] + [size]
+    cpu.proc.init_dmem(data)
+    cpu.parse_source(max_source(size), keep_source=False)
+    start = time.perf_counter()
+    steps = cpu.run(trace=None)
+    elapsed = time.perf_counter() - start
+    if out != [max(data[:size])]:
+        raise RuntimeError('Некорректный результат поиска максимума.')
+    return steps / elapsed, out[0]
+
+
+STAGE_SOURCE = [  # ступень конвейера машин: значение из порта ввода + 1 в порт вывода, 0 - конец потока
+    '.code',
+    'loop: in R 1',
+    '      cmp RI 1 0',
+    '      je  done',
+    '      add RI 1 1',
+    '      out R 1',
+    '      jmp loop',
+    'done: out R 1',
+    '      halt']
+
+
+def bench_async(count=1000, nvalues=100, maxsize=4, every=50):
+    '''замер асинхронного выполнения конвейера из count машин, соединенных очередями размера maxsize
+    (вывод машины - ввод следующей); возвращает (шагов в секунду, время)'''
+    async def pipeline():
+        ports = [asyncio.Queue(maxsize) for idx in range(count + 1)]
+        cpus = []
+        for idx in range(count):
+            cpu = CmdProcessor(storage='array', output=[])
+            cpu.parse_source(STAGE_SOURCE, keep_source=False)
+            cpus.append(cpu)
+
+        async def feed():
+            for value in list(range(1, nvalues + 1)) + [0]:
+                await ports[0].put(value)
+
+        async def collect():
+            return [await ports[count].get() for idx in range(nvalues + 1)]
+
+        start = time.perf_counter()
+        results = await asyncio.gather(feed(), collect(), *[
+            cpu.run_async(ports[idx], ports[idx + 1], every) for idx, cpu in enumerate(cpus)])
+        elapsed = time.perf_counter() - start
+        if results[1] != [value + count for value in range(1, nvalues + 1)] + [0]:
+            raise RuntimeError('Некорректный результат конвейера машин.')
+        return sum(results[2:]), elapsed
+
+    steps, elapsed = asyncio.run(pipeline())
+    return steps / elapsed, elapsed
+
+
+def bench_assembler(nlines):
+    '''замер времени и пиковой памяти потокового ассемблирования синтетического файла из nlines команд'''
+    with tempfile.NamedTemporaryFile('w', suffix='.asm', delete=False) as file:
+        file.writelines(generate_source(nlines))
+    try:
+        size = os.path.getsize(file.name)
+        start = time.perf_counter()
+        asmprogram, mashprog = CmdProcessor(output=[], profile=LARGE_PROFILE).open_asm_file(
+            file.name, keep_source=False)
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()  # память замеряется отдельным запуском, т.к. tracemalloc замедляет выполнение
+        CmdProcessor(output=[], profile=LARGE_PROFILE).open_asm_file(file.name, keep_source=False)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        os.remove(file.name)
+    return size, len(mashprog), elapsed, peak
+
+
+if __name__ == '__main__':  # точка входа в программу
+    if len(sys.argv) > 1 and sys.argv[1] == '--asm':  # замер ассемблера: python bench.py --asm [к-во строк]
+        for nlines in ([int(sys.argv[2])] if len(sys.argv) > 2 else [10000, 100000, 500000]):
+            size, count, elapsed, peak = bench_assembler(nlines)
+            print('%.1f МБ исходного текста, %d команд: %.2f с (%.0f строк/с), пиковая память %.1f МБ' %
+                  (size / 2 ** 20, count, elapsed, count / elapsed, peak / 2 ** 20))
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == '--async':  # конвейер машин: python bench.py --async [к-во машин]
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+        speed, elapsed = bench_async(count)
+        print('%d машин в одном процессе: %.2f с, %.0f шаг/с' % (count, elapsed, speed))
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == '--kernel':  # поиск максимума: python bench.py --kernel [размер]
+        size = int(sys.argv[2]) if len(sys.argv) > 2 else 1 << 20
+        for engine in ('interp', 'block'):
+            speed, result = bench_kernel(size, engine)
+            print('поиск максимума, %d ячеек, %s: %.0f шаг/с' % (size, engine, speed))
+        sys.exit(0)
+    files = sys.argv[1:] if len(sys.argv) > 1 else ['asm1.txt', 'asm2.txt', 'asm3.txt']
+    for fileName in files:
+        slow = bench_file(fileName, predecode=False)
+        fast = bench_file(fileName, predecode=True)
+        flat = bench_file(fileName, predecode=True, storage='array')
+        print('%s: без предекодирования %.0f шаг/с, с предекодированием %.0f шаг/с (x%.2f), '
+              'хранилище array %.0f шаг/с (x%.2f)' % (fileName, slow, fast, fast / slow, flat, flat / slow))
@@ -0,0 +1,4 @@
+# Написано на python 3.7
+# Набор замеров производительности эмулятора: корпус программ (workloads) и замер с базовой линией (harness)
+from benchmarks.workloads import Workload, corpus
+from benchmarks.harness import run_suite, compare, report
@@ -0,0 +1,6 @@
+# Написано на python 3.7
+# Запуск: python -m benchmarks [--quick] [-o результаты.json] [--baseline файл] [--threshold доля] [--update-baseline]
+import sys  # библиотека, необходимая для обработки параметров командной строки
+from benchmarks.harness import main
+
+sys.exit(main())
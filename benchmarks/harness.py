@@ -0,0 +1,209 @@
+# Написано на python 3.7
+# Замер корпуса программ (ассемблирование, шаги в секунду, пиковая память, время импорта и запуска),
+# запись результатов в JSON и сравнение с сохраненной базовой линией.
+# Время выполнения замеряется процессорным временем (time.process_time), а не временем по часам, поэтому
+# другие процессы на машине замер почти не искажают. Базовая линия зависит от машины: для CI она
+# пересоздается на машине CI на неизмененном коде командой python -m benchmarks --update-baseline
+# (с --quick - для быстрого режима, сравнение выполняется только с базовой линией того же режима),
+# и полученный benchmarks/baseline.json сохраняется в репозитории; проверка - python -m benchmarks
+import sys  # библиотека, необходимая для обработки параметров командной строки
+import os
+import json
+import time
+import timeit
+import platform
+import argparse
+import subprocess
+import tracemalloc
+from emulator import CmdProcessor
+try:
+    import resource
+except ImportError:  # нет в Windows: время запуска замеряется по часам
+    resource = None
+from benchmarks.workloads import ROOT, corpus
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')  # базовая линия
+ENGINES = ('interp', 'block')  # способы выполнения: execute_cmd и базовые блоки (jit.py)
+
+
+def new_cpu(workload, engine='interp'):
+    '''обработчик команд с программой и данными workload'''
+    if engine == 'block':
+        from jit import BlockCmdProcessor
+        cpu = BlockCmdProcessor(storage='array', output=[], profile=workload.profile)
+    else:
+        cpu = CmdProcessor(storage='array', output=[], profile=workload.profile)
+    if workload.data is not None:
+        cpu.proc.init_dmem(workload.data)
+    cpu.parse_source(workload.source, keep_source=False)
+    return cpu
+
+
+def run_time(workload, engine, min_time=0.2):
+    '''процессорное время одного выполнения программы workload (без создания обработчика команд) и количество
+    шагов: выполнения повторяются, пока их суммарное время не достигнет min_time секунд'''
+    total, count = 0.0, 0
+    while total < min_time:
+        cpu = new_cpu(workload, engine)
+        start = time.process_time()
+        steps = cpu.run(trace=None)
+        total += time.process_time() - start
+        count += 1
+    return total / count, steps
+
+
+def measure_workload(workload, memory=True):
+    '''один замер программы workload: время ассемблирования, шаги в секунду по способам выполнения и пиковая
+    память (ассемблирования и выполнения, при memory). Действие повторяется, пока не займет не менее 0.2 с
+    процессорного времени (timeit.Timer.autorange), время делится на количество повторов'''
+    result = {'description': workload.description, 'gate': workload.gate}
+    count, total = timeit.Timer(lambda: new_cpu(workload), timer=time.process_time).autorange()
+    result['assemble_s'] = total / count
+    for engine in (ENGINES if workload.execute else ()):
+        elapsed, steps = run_time(workload, engine)
+        if result.setdefault('steps', steps) != steps:
+            raise RuntimeError('Количество шагов %s различается для способов выполнения.' % workload.name)
+        result[engine + '_steps_per_s'] = steps / elapsed
+    if memory:
+        tracemalloc.start()  # память замеряется отдельным запуском, т.к. tracemalloc замедляет выполнение
+        try:
+            cpu = new_cpu(workload)
+            if workload.execute:
+                cpu.run(trace=None)
+            result['peak_kb'] = tracemalloc.get_traced_memory()[1] / 1024
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def measure_startup(repeat=5):
+    '''время импорта модуля emulator и полного запуска эмулятора на asm1.txt (отдельными процессами)
+    за вычетом времени запуска пустого интерпретатора python: процессорное время дочерних процессов
+    (resource.getrusage), без модуля resource - время по часам; берется лучший из repeat запусков'''
+    def elapsed(args):
+        start = child_time()
+        subprocess.run([sys.executable] + args, cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+        return child_time() - start
+
+    pythons, imports, startups = [], [], []
+    for idx in range(repeat):
+        pythons.append(elapsed(['-c', 'pass']))
+        imports.append(elapsed(['-c', 'import emulator']))
+        startups.append(elapsed(['emulator.py', 'asm1.txt']))
+    return {'import_s': max(min(imports) - min(pythons), 0.0), 'startup_s': max(min(startups) - min(pythons), 0.0)}
+
+
+def child_time():
+    '''процессорное время завершенных дочерних процессов (время по часам, если модуль resource недоступен)'''
+    if resource is None:
+        return time.perf_counter()
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def best_result(samples):
+    '''результат из нескольких замеров samples: лучшее значение каждой метрики времени (наибольшее у *_per_s,
+    наименьшее у остальных), остальное - из первого замера'''
+    result = dict(samples[0])
+    for key, value in result.items():
+        if isinstance(value, float) and all(key in sample for sample in samples):
+            result[key] = (max if key.endswith('_per_s') else min)(sample[key] for sample in samples)
+    return result
+
+
+def run_suite(quick=False, repeat=5):
+    '''замер всего корпуса, результат - словарь для записи в JSON. Корпус замеряется repeat кругов подряд,
+    по каждой метрике берется лучший круг: помехи только замедляют выполнение, поэтому лучший круг
+    ближе всего к собственной скорости кода'''
+    workloads = corpus(quick)
+    samples = {workload.name: [] for workload in workloads}
+    startup = []
+    for idx in range(repeat):
+        startup.append(measure_startup())
+        for workload in workloads:
+            samples[workload.name].append(measure_workload(workload, memory=idx == 0))
+    return {'meta': {'mode': 'quick' if quick else 'full', 'python': platform.python_version(),
+                     'platform': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+            'startup': best_result(startup),
+            'workloads': {name: best_result(results) for name, results in samples.items()}}
+
+
+def compare(results, baseline, threshold=0.25):
+    '''сравнение результатов с базовой линией, возвращает список ухудшений больше threshold (доля)
+    и изменений количества шагов; метрики *_per_s - чем больше, тем лучше, остальные - чем меньше.
+    У программ с gate = False (слишком короткие для устойчивого замера) сравнивается только количество шагов'''
+    if results['meta']['mode'] != baseline['meta']['mode']:
+        raise RuntimeError('Режим замера (%s) не совпадает с режимом базовой линии (%s).' % (
+            results['meta']['mode'], baseline['meta']['mode']))
+    sections = [('startup', results['startup'], baseline['startup'])]
+    for name, result in results['workloads'].items():
+        if name in baseline['workloads']:
+            sections.append((name, result, baseline['workloads'][name]))
+    failures = []
+    for name, result, base in sections:
+        for metric, value in result.items():
+            if metric not in base or metric == 'gate' or not isinstance(value, (int, float)):
+                continue
+            if metric != 'steps' and not result.get('gate', True):
+                continue
+            if metric == 'steps':
+                if value != base[metric]:
+                    failures.append('%s: количество шагов %d, в базовой линии %d' % (name, value, base[metric]))
+            elif metric.endswith('_per_s') and value < base[metric] * (1 - threshold) or \
+                    not metric.endswith('_per_s') and value > base[metric] * (1 + threshold):
+                failures.append('%s: %s = %.4g, в базовой линии %.4g (%+.0f%%)' % (
+                    name, metric, value, base[metric], 100 * (value / base[metric] - 1)))
+    return failures
+
+
+def report(results, baseline=None):
+    '''таблица результатов (с изменением шагов в секунду относительно базовой линии)'''
+    lines = ['%-10s %12s %14s %14s %10s  %s' % ('программа', 'ассемб., мс', 'interp шаг/с', 'block шаг/с',
+                                                'память КБ', 'к базовой линии')]
+    for name, result in results['workloads'].items():
+        delta = ''
+        base = baseline['workloads'].get(name) if baseline is not None else None
+        if not result.get('gate', True):
+            delta = 'без сравнения времени'
+        elif base is not None and 'steps' in result:
+            delta = str.join(' ', ['%s %+.0f%%' % (engine, 100 * (result[engine + '_steps_per_s'] /
+                                                               base[engine + '_steps_per_s'] - 1))
+                                   for engine in ENGINES])
+        lines.append('%-10s %12.2f %14s %14s %10.0f  %s' % (
+            name, 1000 * result['assemble_s'], *['%.0f' % result[engine + '_steps_per_s']
+                                                 if engine + '_steps_per_s' in result else '-' for engine in ENGINES],
+            result['peak_kb'], delta))
+    lines.append('импорт emulator %.1f мс, запуск на asm1.txt %.1f мс' % (
+        1000 * results['startup']['import_s'], 1000 * results['startup']['startup_s']))
+    return str.join('\n', lines)
+
+
+def main(argv=None):
+    '''замер из командной строки, возвращает код завершения (1 - есть ухудшения относительно базовой линии)'''
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Замер производительности эмулятора.')
+    parser.add_argument('--quick', action='store_true', help='уменьшенный корпус для быстрой проверки')
+    parser.add_argument('--repeat', type=int, default=5, help='количество кругов замера (берется лучший)')
+    parser.add_argument('-o', '--output', default=None, help='файл результатов JSON')
+    parser.add_argument('--baseline', default=BASELINE, help='файл базовой линии JSON')
+    parser.add_argument('--threshold', type=float, default=0.25, help='допустимое ухудшение (доля)')
+    parser.add_argument('--update-baseline', action='store_true', help='записать результаты как базовую линию')
+    args = parser.parse_args(argv)
+    results = run_suite(args.quick, args.repeat)
+    baseline = None
+    if not args.update_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        if baseline['meta']['mode'] != results['meta']['mode']:
+            print('Базовая линия записана в режиме %s, сравнение пропущено' % baseline['meta']['mode'])
+            baseline = None
+    print(report(results, baseline))
+    for path in ([args.output] if args.output else []) + ([args.baseline] if args.update_baseline else []):
+        with open(path, 'w') as file:
+            json.dump(results, file, indent=1, ensure_ascii=False)
+            file.write('\n')
+    if baseline is None:
+        return 0
+    failures = compare(results, baseline, args.threshold)
+    for failure in failures:
+        print('Ухудшение: %s' % failure)
+    return 1 if failures else 0
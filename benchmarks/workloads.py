@@ -0,0 +1,153 @@
+# Написано на python 3.7
+# Корпус генерируемых программ для замеров: длинные циклы, косвенная адресация, ветвления, большие программы
+import os
+import random
+from emulator import MachineProfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # каталог репозитория с примерами
+LARGE_PROFILE = MachineProfile(cmem_size=1 << 24)  # профиль для синтетических программ большого размера
+
+
+class Workload(object):
+    '''программа для замера: исходный текст, память данных и профиль машины
+
+    name - имя, source - строки исходного текста (с .code), data - значения памяти данных (None - из .data),
+    profile - профиль машины, description - описание, execute - замерять ли выполнение (иначе только ассемблирование),
+    gate - сравнивать ли время с базовой линией (у коротких программ сравнивается только количество шагов)
+    '''
+    def __init__(self, name, source, data=None, profile=None, description='', execute=True, gate=True):
+        self.name = name
+        self.source = source
+        self.data = data
+        self.profile = profile
+        self.description = description
+        self.execute = execute
+        self.gate = gate
+
+
+def generate_source(nlines, ndata=1000):
+    '''генератор синтетического исходного текста из nlines команд с метками и ссылками вперед'''
+    yield '.data  # синтетическая программа\n'
+    for idx in range(ndata):
+        yield '%d\n' % (idx - ndata // 2)
+    yield '.code\n'
+    for idx in range(nlines):
+        if idx % 64 == 0:
+            yield 'l%d: mov RM 1 %d  # начало блока\n' % (idx, idx % ndata % 256)
+        elif idx % 64 == 63:
+            yield '    jg l%d\n' % (idx + 1)  # переход вперед на следующий блок
+        else:
+            yield '    add RX 1 %d\n' % (idx % 10)
+    yield 'l%d: halt\n' % nlines
+
+
+def max_source(size):
+    '''исходный текст поиска максимума массива mem[0]..mem[size - 1]; длина массива в mem[size],
+    результат - в mem[size + 1] (прямые адреса больше 255 кодируются словами расширения)'''
+    return ['.code',
+            '      mov RM 1 0         # reg[1] = mem[0] : текущий максимум',
+            '      mov RM 2 %d        # reg[2] = длина массива' % size,
+            '      mov RI 3 0         # reg[3] : указатель на элемент массива',
+            'loop: cmp RX 1 3         # сравнение максимума с mem[reg[3]]',
+            '      jg  next',
+            '      mov RX 1 3         # новый максимум',
+            'next: add RI 3 1',
+            '      sub RI 2 1',
+            '      cmp RI 2 0',
+            '      jg  loop',
+            '      mov MR %d 1        # запись максимума' % (size + 1),
+            '      out M %d' % (size + 1),
+            '      halt']
+
+
+def sample(filename):
+    '''пример из репозитория (asm1.txt - asm3.txt); несколько десятков шагов - вне сравнения времени'''
+    with open(os.path.join(ROOT, filename), 'r') as file:
+        return Workload(filename, file.readlines(), description='пример из репозитория', gate=False)
+
+
+def long_loop(iterations):
+    '''длинный цикл на регистрах без обращений к памяти данных'''
+    source = ['.code',
+              '      mov RI 1 0     # reg[1] : контрольная сумма',
+              '      mov RM 2 0     # reg[2] = mem[0] : количество итераций',
+              'loop: add RR 1 2',
+              '      xor RI 1 85',
+              '      sub RI 2 1',
+              '      cmp RI 2 0',
+              '      jg  loop',
+              '      out R 1',
+              '      halt']
+    return Workload('loop', source, [iterations], description='цикл на регистрах, %d итераций' % iterations)
+
+
+def pointer_chase(size, seed=0):
+    '''обход связного списка в памяти данных: каждая итерация - косвенное чтение X по случайному адресу'''
+    rng = random.Random(seed)
+    order = list(range(1, size + 1))
+    rng.shuffle(order)
+    data = [size] + [0] * size  # mem[0] - количество шагов обхода, mem[1..size] - адрес следующего узла
+    for idx in range(size):
+        data[order[idx]] = order[(idx + 1) % size]
+    source = ['.code',
+              '      mov RM 2 0     # reg[2] : счетчик шагов',
+              '      mov RI 3 %d    # reg[3] : текущий узел' % order[0],
+              '      mov RI 1 0     # reg[1] : сумма адресов узлов',
+              'loop: add RR 1 3',
+              '      mov RX 3 3     # reg[3] = mem[reg[3]] : переход к следующему узлу',
+              '      sub RI 2 1',
+              '      cmp RI 2 0',
+              '      jg  loop',
+              '      out R 1',
+              '      halt']
+    return Workload('indirect', source, data, MachineProfile(dmem_size=size + 1),
+                    'косвенная адресация X, список из %d узлов' % size)
+
+
+def branchy(size, seed=0):
+    '''подсчет положительных, отрицательных и нулевых элементов: ветвление на каждом элементе'''
+    rng = random.Random(seed)
+    data = [size] + [rng.choice([-1, 0, 1]) * rng.randrange(1, 1000) for idx in range(size)]
+    source = ['.code',
+              '      mov RM 2 0     # reg[2] : счетчик элементов',
+              '      mov RI 3 1     # reg[3] : указатель на элемент',
+              'loop: cmp XI 3 0     # сравнение mem[reg[3]] с 0',
+              '      jg  pos',
+              '      je  zero',
+              '      add RI 4 1     # reg[4] : отрицательные',
+              '      jmp next',
+              'pos:  add RI 5 1     # reg[5] : положительные',
+              '      jmp next',
+              'zero: add RI 6 1     # reg[6] : нулевые',
+              'next: add RI 3 1',
+              '      sub RI 2 1',
+              '      cmp RI 2 0',
+              '      jg  loop',
+              '      out R 4',
+              '      out R 5',
+              '      out R 6',
+              '      halt']
+    return Workload('branchy', source, data, MachineProfile(dmem_size=size + 1),
+                    'ветвления je/jg на каждом элементе, %d элементов' % size)
+
+
+def max_search(size, seed=0):
+    '''поиск максимума массива с прямыми адресами в словах расширения'''
+    rng = random.Random(seed)
+    data = [rng.randrange(-2 ** 31, 2 ** 31) for idx in range(size)] + [size]
+    return Workload('max', max_source(size), data, MachineProfile(dmem_size=size + 2),
+                    'поиск максимума, %d элементов' % size)
+
+
+def large_program(nlines):
+    '''синтетическая программа из nlines команд (нагрузка на ассемблер, не выполняется)'''
+    return Workload('large', list(generate_source(nlines)), profile=LARGE_PROFILE,
+                    description='синтетическая программа, %d команд' % nlines, execute=False)
+
+
+def corpus(quick=False):
+    '''корпус программ для замера (quick - уменьшенные размеры для быстрой проверки)'''
+    scale = 1 if quick else 10
+    return [sample('asm1.txt'), sample('asm2.txt'), sample('asm3.txt'),
+            long_loop(2000 * scale), pointer_chase(2000 * scale), branchy(2000 * scale),
+            max_search(2000 * scale), large_program(5000 * scale)]
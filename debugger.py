@@ -0,0 +1,189 @@
+# Написано на python 3.7
+# Отладчик с выполнением в обратном направлении (журнал отмены в кольцевом буфере ограниченного размера)
+# Запуск: python debugger.py исходный_файл (интерактивный режим)
+import sys  # библиотека, необходимая для обработки параметров командной строки
+from array import array
+from emulator import CmdProcessor
+
+STEP, REG, MEM = 0, 1, 2  # типы записей журнала: начало шага (pc, halt), старое значение регистра, ячейки памяти
+RECORD_SIZE = 16  # размер записи журнала в байтах: array('q') [тип | номер << 2, старое значение]
+
+
+class ReverseDebugger(object):
+    '''отладчик обработчика команд cpu с шагом назад
+
+    При включении (enable) подменяет у cpu метод execute_cmd и у процессора метод write_value на
+    версии, записывающие в журнал только то, что будет перезаписано: pc и halt перед каждой командой и
+    старое значение регистра или ячейки памяти данных перед записью (не более трех записей по 16 байт
+    на шаг: CAS записывает ячейку памяти и reg[0]). Журнал - кольцевой буфер размером max_bytes
+    (не меньше одного шага); при переполнении отбрасываются самые старые шаги целиком. Вывод команды OUT
+    и запись в память команд не отменяются.
+    '''
+    def __init__(self, cpu, max_bytes=1 << 20):
+        if max_bytes < 3 * RECORD_SIZE:
+            raise RuntimeError('Слишком маленький размер журнала отмены (%d байт).' % max_bytes)
+        self.cpu = cpu
+        self.capacity = max_bytes // RECORD_SIZE  # количество записей журнала
+        self.log = array('q', bytes(RECORD_SIZE * self.capacity))
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        '''очистка журнала'''
+        self.head = 0  # номер записи, следующей за последней
+        self.count = 0  # количество записей в журнале
+        self.steps = 0  # количество шагов, которые можно отменить
+
+    def push(self, tag, value):
+        '''добавление записи в журнал с отбрасыванием самого старого шага при переполнении'''
+        log = self.log
+        if self.count == self.capacity:
+            tail = self.head  # при заполненном буфере самая старая запись - на месте новой
+            self.count -= 1
+            self.steps -= 1
+            while self.count and log[2 * ((tail + 1) % self.capacity)] & 0b11 != STEP:
+                tail = (tail + 1) % self.capacity  # записи отброшенного шага
+                self.count -= 1
+        log[2 * self.head] = tag
+        log[2 * self.head + 1] = value
+        self.head = (self.head + 1) % self.capacity
+        self.count += 1
+
+    def pop(self):
+        '''извлечение последней записи журнала (тип, номер, значение)'''
+        self.head = (self.head - 1) % self.capacity
+        self.count -= 1
+        tag, value = self.log[2 * self.head], self.log[2 * self.head + 1]
+        return tag & 0b11, tag >> 2, value
+
+    def enable(self):
+        '''включение записи журнала (подмена методов cpu на записывающие)'''
+        if self.enabled:
+            return
+        cpu, proc = self.cpu, self.cpu.proc
+        self.saved = (cpu.__dict__.get('execute_cmd'), proc.__dict__.get('write_value'))
+        execute_cmd, read_value, write_value = cpu.execute_cmd, proc.read_value, proc.write_value
+        self.write_value = write_value  # запись без журнала (для отмены)
+        push = self.push
+
+        def recorded_execute_cmd():
+            push(STEP | proc.pc << 2, proc.halt)
+            self.steps += 1
+            execute_cmd()
+
+        def recorded_write_value(dst, value, optype):
+            if optype == 0b01:
+                push(REG | dst << 2, read_value(dst, 0b01))
+            elif optype in (0b10, 0b11):
+                cell = dst if optype == 0b10 else read_value(dst, 0b01)
+                old = read_value(dst, optype)  # IndexError - как и при самой записи
+                push(MEM | cell << 2, old)
+            write_value(dst, value, optype)
+
+        cpu.execute_cmd = recorded_execute_cmd
+        proc.write_value = recorded_write_value
+        self.enabled = True
+
+    def disable(self):
+        '''выключение записи журнала (восстановление исходных методов cpu), журнал очищается'''
+        if not self.enabled:
+            return
+        cpu, proc = self.cpu, self.cpu.proc
+        for obj, name, value in ((cpu, 'execute_cmd', self.saved[0]), (proc, 'write_value', self.saved[1])):
+            if value is None:
+                del obj.__dict__[name]
+            else:
+                setattr(obj, name, value)
+        self.reset()
+        self.enabled = False
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.disable()
+
+    def step(self, n=1):
+        '''выполнение не более n шагов вперед, возвращает количество выполненных шагов'''
+        proc = self.cpu.proc
+        done = 0
+        while done < n and not proc.halt:
+            self.cpu.execute_cmd()
+            done += 1
+        return done
+
+    def run(self, max_steps=None):
+        '''выполнение до останова (не более max_steps шагов), возвращает количество выполненных шагов'''
+        return self.step(float('inf') if max_steps is None else max_steps)
+
+    def step_back(self, n=1):
+        '''отмена не более n последних шагов, возвращает количество отмененных шагов'''
+        proc = self.cpu.proc
+        done = 0
+        while done < n and self.steps:
+            while True:
+                kind, index, value = self.pop()
+                if kind == STEP:
+                    proc.pc, proc.halt = index, bool(value)
+                    break
+                self.write_value(index, value, 0b01 if kind == REG else 0b10)  # страница отмечается для снимков
+            self.steps -= 1
+            done += 1
+        return done
+
+    def last_write(self, index, optype=0b10):
+        '''количество шагов назад до последней записи в ячейку памяти index (optype 0b01 - в регистр),
+        None - записи нет в журнале'''
+        kind = REG if optype == 0b01 else MEM
+        steps = 0
+        pos = self.head
+        for idx in range(self.count):
+            pos = (pos - 1) % self.capacity
+            tag = self.log[2 * pos]
+            if tag & 0b11 == STEP:
+                steps += 1
+            elif tag == kind | index << 2:
+                return steps + 1  # запись сделана шагом, начало которого еще впереди по журналу
+        return None
+
+    def back_to_write(self, index, optype=0b10):
+        '''выполнение назад до команды, последней записавшей ячейку памяти index (optype 0b01 - регистр);
+        состояние - перед выполнением этой команды. Возвращает количество отмененных шагов или None'''
+        steps = self.last_write(index, optype)
+        return None if steps is None else self.step_back(steps)
+
+
+if __name__ == '__main__':  # точка входа в программу
+    if len(sys.argv) != 2:
+        print('Использование: python debugger.py исходный_файл')
+        sys.exit(1)
+    proc = CmdProcessor(storage='array')
+    try:
+        proc.open_asm_file(sys.argv[1])
+    except RuntimeError as err:
+        print(err.args[0])
+        sys.exit(1)
+    print('Команды: s [n] - шаг вперед, b [n] - шаг назад, r - до останова, w k - назад до записи mem[k], '
+          'p - состояние, q - выход')
+    with ReverseDebugger(proc) as debugger:
+        while True:
+            print('pc = %d: %s' % (proc.proc.pc, proc.disassemble(int.from_bytes(proc.proc.cmem[proc.proc.pc], 'big'))
+                                   if proc.proc.pc < len(proc.proc.cmem) else '-'))
+            command = input('> ').split()
+            try:
+                if not command or command[0] == 's':
+                    debugger.step(int(command[1]) if len(command) > 1 else 1)
+                elif command[0] == 'b':
+                    debugger.step_back(int(command[1]) if len(command) > 1 else 1)
+                elif command[0] == 'r':
+                    debugger.run()
+                elif command[0] == 'w' and len(command) == 2:
+                    if debugger.back_to_write(int(command[1])) is None:
+                        print('Запись mem[%s] в журнале не найдена' % command[1])
+                elif command[0] == 'p':
+                    print(proc)
+                elif command[0] == 'q':
+                    break
+            except (RuntimeError, IndexError, ValueError) as err:
+                print('Ошибка: %s' % err)
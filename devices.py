@@ -0,0 +1,79 @@
+# Написано на python 3.7
+# Устройства ввода/вывода для асинхронного выполнения программ (CmdProcessor.run_async)
+# Порт устройства - очередь asyncio.Queue: машина читает порт ввода командой IN и пишет в порт вывода командой OUT
+# Запуск: python devices.py исходный_файл [значения...] (выполнение программы с устройством-заглушкой)
+import sys  # библиотека, необходимая для обработки параметров командной строки
+import asyncio
+from emulator import CmdProcessor
+
+
+class StandInDevice(object):
+    '''локальное устройство-заглушка: передает машине значения values через порт inport
+    и собирает значения, выведенные машиной в порт outport, в список received'''
+    def __init__(self, values=(), maxsize=0):
+        self.inport = asyncio.Queue(maxsize)  # порт ввода машины
+        self.outport = asyncio.Queue(maxsize)  # порт вывода машины
+        self.values = list(values)
+        self.received = []
+
+    async def feed(self):
+        '''передача значений в порт ввода (с ожиданием при заполненной очереди)'''
+        for value in self.values:
+            await self.inport.put(value)
+
+    async def collect(self, count):
+        '''получение count значений из порта вывода'''
+        for idx in range(count):
+            self.received.append(await self.outport.get())
+        return self.received
+
+    async def serve(self, cpu, count=None, **kwargs):
+        '''выполнение программы cpu с этим устройством, count - ожидаемое количество выведенных значений
+        (None - значения забираются после останова машины), возвращает количество выполненных шагов'''
+        feeder = asyncio.ensure_future(self.feed())
+        collector = asyncio.ensure_future(self.collect(count)) if count is not None else None
+        try:
+            steps = await cpu.run_async(self.inport, self.outport, **kwargs)
+            if collector is not None:
+                await collector
+            while not self.outport.empty():
+                self.received.append(self.outport.get_nowait())
+        finally:
+            feeder.cancel()
+        return steps
+
+
+async def stream_port(port, writer, count=None):
+    '''построчная передача значений из порта port в поток writer (текстовый файл или asyncio.StreamWriter,
+    например сокет); завершается после count значений или значения None, возвращает количество значений'''
+    sent = 0
+    while count is None or sent < count:
+        value = await port.get()
+        if value is None:
+            break
+        if isinstance(writer, asyncio.StreamWriter):
+            writer.write(b'%d\n' % value)
+            await writer.drain()
+        else:
+            writer.write('%d\n' % value)
+        sent += 1
+    return sent
+
+
+if __name__ == '__main__':  # точка входа в программу
+    if len(sys.argv) < 2:
+        print('Использование: python devices.py исходный_файл [значения...]')
+        sys.exit(1)
+
+    async def main():
+        cpu = CmdProcessor(storage='array')
+        cpu.open_asm_file(sys.argv[1])
+        device = StandInDevice([int(value, 0) for value in sys.argv[2:]])
+        steps = await device.serve(cpu)
+        print('Выполнено шагов: %d, выведено: %s' % (steps, device.received))
+
+    try:
+        asyncio.run(main())
+    except RuntimeError as err:
+        print(err.args[0])
+        sys.exit(1)
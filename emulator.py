@@ -1,5 +1,20 @@
 # Написано на python 3.7
 import sys  # библиотека, необходимая для обработки параметра командной строки
+import os  # атомарная запись файлов снимков состояния
+import json  # запись трассировки в формате JSON lines
+import struct  # запись трассировки в двоичном формате
+import time  # ограничение времени выполнения программы
+import itertools  # конвейер потокового ассемблера
+import functools
+from array import array  # компактные типизированные массивы для хранилища 'array'
+
+
+def wrap_int(ivalue, signed=True):
+    '''усечение python int до 32 бит (старшие биты отбрасываются)'''
+    ivalue &= 0xffffffff
+    if signed and ivalue & 0x80000000:  # знаковый бит установлен
+        ivalue -= 0x100000000
+    return ivalue
 
 
 def int_to_byte(ivalue, signed=True):
@@ -7,7 +22,7 @@ def int_to_byte(ivalue, signed=True):
     try:
         bvalue = bytearray(int.to_bytes(ivalue, 4, byteorder='big', signed=signed))
     except OverflowError:  # при переполнении старшие биты отбрасываются
-        bvalue = bytearray(int.to_bytes(int(format(ivalue, '0b')[-32:], base=2), 4, byteorder='big', signed=signed))
+        bvalue = bytearray(int.to_bytes(wrap_int(ivalue, signed), 4, byteorder='big', signed=signed))
     return bvalue
 
 
@@ -16,34 +31,75 @@ def byte_to_int(bvalue, signed=True):
     return int.from_bytes(bvalue, byteorder='big', signed=signed)
 
 
+EXT_OP1 = 1 << 16  # флаг команды: первый операнд записан в следующем за командой слове расширения
+EXT_OP2 = 1 << 17  # флаг команды: второй операнд записан в слове расширения (после слова первого операнда)
+
+
+class MachineProfile(object):
+    '''профиль машины
+
+    registers - количество регистров,
+    dmem_size - размер памяти данных в ячейках (None - по количеству значений секции .data, без нее 10);
+                данные дополняются нулевыми ячейками до этого размера,
+    cmem_size - размер памяти команд в словах (None - по размеру программы); при размере больше 256 переходы
+                вперед на метки кодируются словом расширения (адрес перехода до 32 бит), при None - только
+                если адрес метки впереди не помещается в команду
+    '''
+    def __init__(self, registers=10, dmem_size=None, cmem_size=None):
+        self.registers = registers
+        self.dmem_size = dmem_size
+        self.cmem_size = cmem_size
+
+    def __repr__(self):
+        return 'MachineProfile(registers=%d, dmem_size=%r, cmem_size=%r)' % (
+            self.registers, self.dmem_size, self.cmem_size)
+
+
 class Processor(object):
-    '''процессор'''
-    def __init__(self, program=None, data=None):
-        self.reg = [bytearray(4), bytearray(4), bytearray(4), bytearray(4), bytearray(4),
-                    bytearray(4), bytearray(4), bytearray(4), bytearray(4), bytearray(4),
-                    ]  # массив 32 битных регистров (10 регистров)
+    '''процессор
+
+    storage - хранилище регистров и памяти данных:
+    'bytes' - список 4-байтных bytearray (ячейка на каждое значение),
+    'array' - типизированный массив array('i') 32-битных целых без выделения памяти при записи
+    profile - профиль машины (MachineProfile), по умолчанию 10 регистров и 256 слов памяти команд
+    '''
+    PAGE_SHIFT = 6  # размер страницы памяти данных для снимков состояния - 2**PAGE_SHIFT ячеек
+
+    def __init__(self, program=None, data=None, storage='bytes', profile=None):
+        if storage not in ('bytes', 'array'):
+            raise RuntimeError('Некорректный тип хранилища %s.' % storage)
+        self.storage = storage
+        self.profile = profile if profile is not None else MachineProfile()  # профиль машины
+        if storage == 'array':  # замена методов доступа к данным на работающие с array
+            self.read_value = self.read_value_array
+            self.write_value = self.write_value_array
+        self.reg = self.new_cells(self.profile.registers)  # массив 32 битных регистров
         if program is None:
             self.cmem = []  # память команд
-            for idx in range(256):
+            for idx in range(min(self.profile.cmem_size or 256, 256)):
                 self.cmem.append(bytearray(4))
             self.cmem[0] = int_to_byte(0b11111100_00000000_00000000_00000000, signed=False)
+            self.dcache = [None] * len(self.cmem)  # кэш предекодированных команд
+            self.cmem_version = 0  # номер версии памяти команд (увеличивается при каждом ее изменении)
         else:
             self.init_cmem(program)
         if data is None:
-            self.dmem = []  # память данных
-            for idx in range(10):
-                self.dmem.append(bytearray(4))
+            self.dmem = self.new_cells(10 if self.profile.dmem_size is None else self.profile.dmem_size)  # память данных
         else:
             self.init_dmem(data)
         self.pc = 0  # счетчик команд
         self.halt = False  # флаг останова
+        self.pages = None  # страницы памяти данных последнего снимка состояния (bytes)
+        self.pages_of = None  # память данных, к которой относятся страницы self.pages
+        self.dirty = None  # номера страниц, измененных после последнего снимка (None - учет выключен)
+        self.cmem_image = None  # образ памяти команд последнего снимка (версия памяти команд, bytes)
 
     def __str__(self):  # вывод текущих данных процессора
         s = 'pc: %d\n' % self.pc
         s += 'Регистры: [\n%s]\n' % (
-            str.join(',\n', [format(byte_to_int(regvalue), '#034b') for regvalue in self.reg]))
+            str.join(',\n', [format(regvalue, '#034b') for regvalue in self.values(self.reg)]))
         s += 'Память данных: [\n%s]\n' % (
-            str.join(',\n', [format(byte_to_int(memvalue), '#034b') for memvalue in self.dmem]))
+            str.join(',\n', [format(memvalue, '#034b') for memvalue in self.values(self.dmem)]))
         #s += 'Память команд: [\n%s]\n' % (
         #    str.join(',\n', [format(byte_to_int(memvalue), '#035b') for memvalue in self.cmem]))
         return s
@@ -52,16 +108,179 @@ class Processor(object):
         return str(self)
 
     def init_cmem(self, program):
-        ''''''
+        '''запись программы в память команд процессора'''
+        self.check_cmem_size(len(program))
         self.cmem = []
         for idx in range(len(program)):
             self.cmem.append(int_to_byte(program[idx], signed=False))
+        self.dcache = [None] * len(self.cmem)  # кэш предекодированных команд (заполняется обработчиком команд)
+        self.cmem_version = getattr(self, 'cmem_version', -1) + 1  # номер версии памяти команд
+
+    def load_cmem_image(self, buf):
+        '''запись программы из буфера buf (4-байтные big-endian команды, например mmap файла образа)'''
+        self.check_cmem_size(len(buf) // 4)
+        self.cmem = [bytearray(buf[idx:idx + 4]) for idx in range(0, len(buf), 4)]
+        self.dcache = [None] * len(self.cmem)
+        self.cmem_version = getattr(self, 'cmem_version', -1) + 1
+
+    def check_cmem_size(self, count):
+        '''проверка, что программа из count слов помещается в память команд профиля'''
+        if self.profile.cmem_size is not None and count > self.profile.cmem_size:
+            raise RuntimeError('Программа не помещается в память команд (%d > %d слов).' % (
+                count, self.profile.cmem_size))
+
+    def write_cmem(self, addr, value):
+        '''запись команды value в ячейку addr памяти команд со сбросом предекодированных записей, в которые
+        входит это слово: команда со словами расширения занимает до 3 слов, суперкоманда cmp + je/jg - до 5'''
+        self.cmem[addr] = int_to_byte(value, signed=False)
+        for idx in range(max(addr - 4, 0), addr + 1):
+            self.dcache[idx] = None
+        self.cmem_version += 1
+
+    def new_cells(self, count):
+        '''создание count обнуленных 32-битных ячеек в выбранном хранилище'''
+        if self.storage == 'array':
+            return array('i', bytes(4 * count))
+        return [bytearray(4) for idx in range(count)]
+
+    def values(self, cells):
+        '''список значений ячеек cells (регистров или памяти данных) в виде python int'''
+        if self.storage == 'array':
+            return list(cells)
+        return [byte_to_int(bvalue) for bvalue in cells]
 
     def init_dmem(self, data):
-        '''запись памяти данных в процессор'''
-        self.dmem = []
-        for idx in range(len(data)):
-            self.dmem.append(int_to_byte(data[idx]))
+        '''запись памяти данных в процессор (с дополнением нулями до размера памяти данных профиля)'''
+        size = len(getattr(self, 'dmem', ()))
+        padding = self.dmem_padding(len(data))
+        if self.storage == 'array':
+            self.dmem = array('i', [wrap_int(value) for value in data])
+            self.dmem.frombytes(bytes(4 * padding))
+        else:
+            self.dmem = []
+            for idx in range(len(data)):
+                self.dmem.append(int_to_byte(data[idx]))
+            self.dmem += [bytearray(4) for idx in range(padding)]
+        self.dmem_resized(size)
+
+    def load_dmem_image(self, buf):
+        '''запись памяти данных из буфера buf (4-байтные big-endian знаковые значения)'''
+        size = len(getattr(self, 'dmem', ()))
+        padding = self.dmem_padding(len(buf) // 4)
+        if self.storage == 'array':
+            self.dmem = array('i')
+            self.dmem.frombytes(buf)
+            if sys.byteorder == 'little':
+                self.dmem.byteswap()
+            self.dmem.frombytes(bytes(4 * padding))
+        else:
+            self.dmem = [bytearray(buf[idx:idx + 4]) for idx in range(0, len(buf), 4)]
+            self.dmem += [bytearray(4) for idx in range(padding)]
+        self.dmem_resized(size)
+
+    def dmem_padding(self, count):
+        '''количество нулевых ячеек, дополняющих count значений до размера памяти данных профиля'''
+        if self.profile.dmem_size is None:
+            return 0
+        if count > self.profile.dmem_size:
+            raise RuntimeError('Данные не помещаются в память данных (%d > %d ячеек).' % (
+                count, self.profile.dmem_size))
+        return self.profile.dmem_size - count
+
+    def dmem_resized(self, size):
+        '''сброс предекодированных команд при изменении размера памяти данных с size ячеек
+        (прямые адреса операндов проверяются при предекодировании)'''
+        if len(self.dmem) != size and hasattr(self, 'dcache'):
+            self.dcache = [None] * len(self.cmem)
+            self.cmem_version += 1
+
+    def cells_to_bytes(self, cells):
+        '''значения ячеек cells (копии среза регистров или памяти данных) в виде bytes ('>i' на значение)'''
+        if self.storage == 'array':
+            if sys.byteorder == 'little':
+                cells.byteswap()
+            return cells.tobytes()
+        return bytes().join(cells)
+
+    def cells_from_bytes(self, buf):
+        '''ячейки выбранного хранилища из буфера buf ('>i' на значение)'''
+        if self.storage == 'array':
+            cells = array('i')
+            cells.frombytes(buf)
+            if sys.byteorder == 'little':
+                cells.byteswap()
+            return cells
+        return [bytearray(buf[idx:idx + 4]) for idx in range(0, len(buf), 4)]
+
+    def track_dirty(self):
+        '''включение учета измененных страниц памяти данных (страницы отмечают методы записи write_value,
+        поэтому учет не теряется при подмене write_value профилировщиком или отладчиком)'''
+        if self.dirty is None:
+            self.dirty = set()
+
+    def mark_dirty(self, addr):
+        '''отметка страницы ячейки addr памяти данных измененной'''
+        self.dirty.add(addr >> self.PAGE_SHIFT)
+
+    def touch_dmem(self):
+        '''отметка всех страниц памяти данных измененными (после записи в память данных в обход write_value)'''
+        if self.dirty is not None:
+            self.dirty.update(range((len(self.dmem) + (1 << self.PAGE_SHIFT) - 1) >> self.PAGE_SHIFT))
+
+    def snapshot(self):
+        '''снимок состояния процессора (pc, halt, регистры, память команд и данных)
+
+        Память данных хранится страницами по 2**PAGE_SHIFT ячеек; страницы, не измененные после
+        предыдущего снимка, используются снимками совместно, поэтому снимок копирует только измененные
+        страницы. Образ памяти команд пересоздается только после ее изменения (по cmem_version).
+        '''
+        self.track_dirty()
+        size = 1 << self.PAGE_SHIFT
+        if self.pages_of is not self.dmem:  # память данных заменена целиком (init_dmem, load_dmem_image)
+            self.pages = [self.cells_to_bytes(self.dmem[start:start + size])
+                          for start in range(0, len(self.dmem), size)]
+            self.pages_of = self.dmem
+        else:
+            for idx in self.dirty:
+                if isinstance(self.dmem, PagedCells):  # страница, общая со снимком, не копируется
+                    self.pages[idx] = self.dmem.page_bytes(idx)
+                else:
+                    self.pages[idx] = self.cells_to_bytes(self.dmem[idx * size:(idx + 1) * size])
+        self.dirty.clear()
+        if self.cmem_image is None or self.cmem_image[0] != self.cmem_version:
+            self.cmem_image = (self.cmem_version, bytes().join(self.cmem))
+        reg = self.reg[:] if self.storage == 'array' else self.reg
+        return Snapshot(self.pc, self.halt, self.cells_to_bytes(reg), self.cmem_image[1], tuple(self.pages))
+
+    def restore(self, snap, share=False):
+        '''восстановление состояния процессора из снимка snap; перезаписываются только страницы памяти
+        данных, отличающиеся от снимка, память команд перезагружается только если она изменилась.
+        share - память данных, заменяемая целиком, разделяет страницы со снимком (PagedCells)'''
+        if self.cmem_image is None or self.cmem_image[0] != self.cmem_version or self.cmem_image[1] is not snap.cmem:
+            self.load_cmem_image(snap.cmem)
+            self.cmem_image = (self.cmem_version, snap.cmem)
+        self.track_dirty()
+        size = 1 << self.PAGE_SHIFT
+        if self.pages_of is self.dmem and len(self.pages) == len(snap.pages):
+            for idx, page in enumerate(snap.pages):
+                if page is not self.pages[idx] or idx in self.dirty:
+                    if isinstance(self.dmem, PagedCells):  # страница снова становится общей со снимком
+                        self.dmem.pages[idx] = page
+                    else:
+                        self.dmem[idx * size:(idx + 1) * size] = self.cells_from_bytes(page)
+        else:
+            size = len(self.dmem)
+            if share:
+                self.dmem = PagedCells(self, snap.pages)
+            else:
+                self.dmem = self.cells_from_bytes(bytes().join(snap.pages))
+            self.pages_of = self.dmem
+            self.dmem_resized(size)
+        self.pages = list(snap.pages)
+        self.dirty.clear()
+        self.reg[:] = self.cells_from_bytes(snap.reg)
+        self.pc = snap.pc
+        self.halt = snap.halt
 
     def decode_op_type(self, cmd, opnum):
         '''определение типа операнда № opnum'''
@@ -79,7 +298,10 @@ class Processor(object):
         elif optype == 0b10:
             return byte_to_int(self.dmem[src])
         elif optype == 0b11:
-            return byte_to_int(self.dmem[byte_to_int(self.reg[src])])
+            addr = byte_to_int(self.reg[src])
+            if addr < 0:  # отрицательный адрес - выход за границы, как и адрес за концом памяти
+                raise IndexError(addr)
+            return byte_to_int(self.dmem[addr])
         else:
             raise RuntimeError('Некорректный тип адресации операнда')
 
@@ -89,16 +311,249 @@ class Processor(object):
             self.reg[dst] = int_to_byte(value)
         elif optype == 0b10:
             self.dmem[dst] = int_to_byte(value)
+            if self.dirty is not None:
+                self.mark_dirty(dst)
         elif optype == 0b11:
-            self.dmem[byte_to_int(self.reg[dst])] = int_to_byte(value)
+            addr = byte_to_int(self.reg[dst])
+            if addr < 0:
+                raise IndexError(addr)
+            self.dmem[addr] = int_to_byte(value)
+            if self.dirty is not None:
+                self.mark_dirty(addr)
         else:
             raise RuntimeError('Некорректный тип адресации операнда')
 
+    def read_value_array(self, src, optype):
+        '''чтение значения из источника src типа адресации optype (хранилище 'array')'''
+        if optype == 0b00:
+            return src
+        elif optype == 0b01:
+            return self.reg[src]
+        elif optype == 0b10:
+            return self.dmem[src]
+        elif optype == 0b11:
+            addr = self.reg[src]
+            if addr < 0:  # отрицательный адрес - выход за границы, как и адрес за концом памяти
+                raise IndexError(addr)
+            return self.dmem[addr]
+        else:
+            raise RuntimeError('Некорректный тип адресации операнда')
+
+    def write_value_array(self, dst, value, optype):
+        '''запись значения value в приемник dst типа адресации optype (хранилище 'array')'''
+        try:
+            if optype == 0b01:
+                self.reg[dst] = value
+            elif optype == 0b10:
+                self.dmem[dst] = value
+                if self.dirty is not None:
+                    self.mark_dirty(dst)
+            elif optype == 0b11:
+                addr = self.reg[dst]
+                if addr < 0:
+                    raise IndexError(addr)
+                self.dmem[addr] = value
+                if self.dirty is not None:
+                    self.mark_dirty(addr)
+            else:
+                raise RuntimeError('Некорректный тип адресации операнда')
+        except (OverflowError, ValueError):  # при переполнении старшие биты отбрасываются (ValueError - memoryview)
+            self.write_value_array(dst, wrap_int(value), optype)
+
+
+class PagedCells(object):
+    '''память данных с копированием страниц при записи (память копии обработчика команд, CmdProcessor.fork)
+
+    Страницы снимка (bytes, '>i' на значение) используются совместно со снимком; при первой записи
+    в страницу она копируется в ячейки хранилища процессора (array('i') или список bytearray), поэтому
+    копия создается за O(количества страниц) и копирует только те страницы, в которые пишет.
+    Поддерживает операции процессора с памятью данных: len, итерацию, чтение и запись ячейки и среза.
+    '''
+    CELL = struct.Struct('>i')
+
+    def __init__(self, proc, pages):
+        self.proc = proc  # процессор (хранилище ячеек скопированных страниц)
+        self.pages = list(pages)  # страницы: bytes (общая со снимком) или ячейки хранилища (скопированная)
+        self.shift = proc.PAGE_SHIFT
+        self.size = ((len(self.pages) - 1 << self.shift) + len(self.pages[-1]) // 4) if self.pages else 0
+        self.mask = (1 << proc.PAGE_SHIFT) - 1
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for page in self.pages:
+            if type(page) is not bytes:
+                yield from page
+            elif self.proc.storage == 'array':
+                for value, in self.CELL.iter_unpack(page):
+                    yield value
+            else:
+                for start in range(0, len(page), 4):
+                    yield bytearray(page[start:start + 4])
+
+    def page_bytes(self, num):
+        '''страница num в виде bytes ('>i' на значение)'''
+        page = self.pages[num]
+        return page if type(page) is bytes else self.proc.cells_to_bytes(page[:])
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):  # срез - копия ячеек в хранилище процессора
+            start, stop, step = idx.indices(self.size)
+            if step != 1:
+                return self.proc.cells_from_bytes(bytes().join(map(self.page_bytes, range(len(self.pages)))))[idx]
+            if start >= stop:
+                return self.proc.cells_from_bytes(bytes())
+            first = start >> self.shift
+            buf = bytes().join(map(self.page_bytes, range(first, ((stop - 1) >> self.shift) + 1)))
+            offset = first << self.shift
+            return self.proc.cells_from_bytes(buf[4 * (start - offset):4 * (stop - offset)])
+        if not 0 <= idx < self.size:
+            raise IndexError(idx)
+        page = self.pages[idx >> self.shift]
+        if type(page) is not bytes:
+            return page[idx & self.mask]
+        offset = (idx & self.mask) << 2
+        if self.proc.storage == 'array':
+            return self.CELL.unpack_from(page, offset)[0]
+        return bytearray(page[offset:offset + 4])
+
+    def __setitem__(self, idx, value):
+        if isinstance(idx, slice):
+            for addr, cell in zip(range(*idx.indices(self.size)), value):
+                self[addr] = cell
+            return
+        if not 0 <= idx < self.size:
+            raise IndexError(idx)
+        num = idx >> self.shift
+        page = self.pages[num]
+        if type(page) is bytes:  # первая запись в общую страницу - копирование страницы
+            page = self.pages[num] = self.proc.cells_from_bytes(page)
+        page[idx & self.mask] = value
+
+
+SNAPSHOT_MAGIC = b'EMUS'  # сигнатура файла снимка состояния
+SNAPSHOT_VERSION = 1  # версия формата снимка
+SNAPSHOT_HEADER = struct.Struct('>4sHIBHII')  # сигнатура, версия, pc, halt, к-во регистров, команд, ячеек памяти
+
+
+class Snapshot(object):
+    '''снимок состояния процессора (Processor.snapshot), не изменяется после создания
+
+    reg - значения регистров, cmem - память команд ('>I' на команду), pages - кортеж страниц памяти данных
+    (bytes, '>i' на значение). Файл снимка: заголовок SNAPSHOT_HEADER, регистры, команды, память данных.
+    '''
+    def __init__(self, pc, halt, reg, cmem, pages):
+        self.pc = pc
+        self.halt = halt
+        self.reg = reg
+        self.cmem = cmem
+        self.pages = pages
+
+    def to_bytes(self):
+        '''сериализация снимка'''
+        dmem = bytes().join(self.pages)
+        return (SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.pc, self.halt, len(self.reg) // 4,
+                                     len(self.cmem) // 4, len(dmem) // 4) + self.reg + self.cmem + dmem)
+
+    @classmethod
+    def from_bytes(cls, buf, page_shift=Processor.PAGE_SHIFT):
+        '''восстановление снимка из буфера buf'''
+        if len(buf) < SNAPSHOT_HEADER.size:
+            raise RuntimeError('Некорректный снимок состояния процессора.')
+        magic, version, pc, halt, nreg, ncmd, ndata = SNAPSHOT_HEADER.unpack_from(buf)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or len(buf) != SNAPSHOT_HEADER.size + 4 * (
+                nreg + ncmd + ndata):
+            raise RuntimeError('Некорректный снимок состояния процессора.')
+        start = SNAPSHOT_HEADER.size
+        reg = bytes(buf[start:start + 4 * nreg])
+        cmem = bytes(buf[start + 4 * nreg:start + 4 * (nreg + ncmd)])
+        dmem = bytes(buf[start + 4 * (nreg + ncmd):])
+        size = 4 << page_shift
+        return cls(pc, bool(halt), reg, cmem, tuple(dmem[idx:idx + size] for idx in range(0, len(dmem), size)))
+
+    def save(self, filename):
+        '''запись снимка в файл (через временный файл с атомарной заменой)'''
+        with open(filename + '.tmp', 'wb') as file:
+            file.write(self.to_bytes())
+        os.replace(filename + '.tmp', filename)
+
+    @classmethod
+    def load(cls, filename):
+        '''чтение снимка из файла'''
+        with open(filename, 'rb') as file:
+            return cls.from_bytes(file.read())
+
+
+class Checkpoint(object):
+    '''приемник трассировки, сохраняющий снимок состояния в файл (контрольная точка длительного выполнения):
+    run(trace='step', every=N, sink=Checkpoint(filename)); продолжение - CmdProcessor.restore(Snapshot.load(...))'''
+    def __init__(self, filename):
+        self.filename = filename
+
+    def __call__(self, step, cmdproc):
+        cmdproc.proc.snapshot().save(self.filename)
+
+
+class TraceWriter(object):
+    '''потоковая запись трассировки выполнения в файл через буферизованный вывод
+
+    fmt - формат записей:
+    'jsonl' - строка JSON {"step", "pc", "halt", "reg", "dmem"} на каждую запись,
+    'bin' - заголовок '>IIBHI' (шаг, pc, halt, к-во регистров, к-во ячеек памяти),
+            за которым следуют значения регистров и памяти данных ('>i' на значение)
+    '''
+    def __init__(self, filename, fmt='jsonl', buffering=1 << 16):
+        if fmt not in ('jsonl', 'bin'):
+            raise RuntimeError('Некорректный формат трассировки %s.' % fmt)
+        self.fmt = fmt
+        self.file = open(filename, 'wb', buffering=buffering)
+
+    def __call__(self, step, cmdproc):
+        '''запись состояния процессора после шага step'''
+        proc = cmdproc.proc
+        reg = proc.values(proc.reg)
+        dmem = proc.values(proc.dmem)
+        if self.fmt == 'jsonl':
+            record = {'step': step, 'pc': proc.pc, 'halt': proc.halt, 'reg': reg, 'dmem': dmem}
+            self.file.write(json.dumps(record, separators=(',', ':')).encode() + b'\n')
+        else:
+            self.file.write(struct.pack('>IIBHI', step, proc.pc, proc.halt, len(reg), len(dmem)))
+            self.file.write(struct.pack('>%di' % (len(reg) + len(dmem)), *reg, *dmem))
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
 
 class CmdProcessor(object):
-    '''обработчик команд процессора'''
-    def __init__(self, program=None, data=None):
-        self.proc = Processor(program, data)  # процессор
+    '''обработчик команд процессора
+
+    output - приемник значений команды OUT: None (вывод на экран), список или функция от значения
+    profile - профиль машины (MachineProfile)
+    input - источник значений команды IN: None (ввод с клавиатуры), список (итерируемый объект) или функция
+    '''
+    def __init__(self, program=None, data=None, predecode=True, storage='bytes', output=None, profile=None,
+                 input=None):
+        self.proc = Processor(program, data, storage, profile)  # процессор
+        self.predecode = predecode  # флаг кэширования предекодированных команд
+        if output is None:
+            self.output = self.print_output
+        elif isinstance(output, list):
+            self.output = output.append
+        else:
+            self.output = output
+        if input is None:
+            self.input = self.read_input
+        elif callable(input):
+            self.input = input
+        else:
+            self.input = functools.partial(self.next_input, iter(input))
         self.kops = {  # словарь кодов команд {код: (имя, обработчик, к-во операндов, тип операнда1, тип операнда2)}
             0b000000: ('NOP', self.nop_handler, 0),  # No-OP пустая команда
             0b000001: ('MOV', self.mov_handler, 2, 'RMX', 'IRMX'),  # пересылка
@@ -113,6 +568,9 @@ class CmdProcessor(object):
             0b001010: ('JE', self.je_handler, 1, 'I'),  # переход по равно 0
             0b001011: ('JG', self.jg_handler, 1, 'I'),  # переход по >
             0b010000: ('OUT', self.out_handler, 1, 'IRMX'),  # вывод значения на устойство вывода
+            0b010001: ('IN', self.in_handler, 1, 'RMX'),  # ввод значения с устройства ввода
+            0b010010: ('CAS', self.cas_handler, 2, 'MX', 'IRMX'),  # атомарное сравнение с обменом
+            0b010011: ('FENCE', self.fence_handler, 0),  # барьер памяти
             0b111111: ('HALT', self.halt_handler, 0)  # останов выполнения программы
         }
         self.optypes = {  # мнемоники типов операнда
@@ -121,6 +579,12 @@ class CmdProcessor(object):
             'M': 0b10,  # доступ к ячейке памяти по номеру
             'X': 0b11  # доступ к ячейке памяти по номеру регистра, в котором хранится номер ячейки
         }
+        self.labels = {}  # метки последней ассемблированной программы {метка: адрес}
+        self.lines = []  # номера строк исходного текста команд последней ассемблированной программы
+        self.passes = []  # проходы оптимизации программы, функции (обработчик команд, программа) -> программа
+        self.fuse = False  # флаг слияния пар cmp + je/jg в суперкоманды при предекодировании
+        self.lock = None  # блокировка общей памяти данных для CAS/FENCE (многопроцессный режим smp.py)
+        self.decode_cmem()
 
     def __str__(self):  # вывод текущих данных процессора
         return str(self.proc)
@@ -128,29 +592,66 @@ class CmdProcessor(object):
     def __repr__(self):
         return str(self)
 
-    def assemble(self, asmprog, code_section_start_idx=0):
-        '''перевод программы на языке ассемблера в машинные коды'''
+    def read_source(self, source):
+        '''чтение исходного текста source (файл или любой итерируемый объект строк),
+        генератор (номер строки, строка без комментария и пробельных символов по краям)'''
+        for lineno, line in enumerate(source, 1):
+            pos = line.find('#')  # удаление комментариев (# ...)
+            yield lineno, (line if pos == -1 else line[:pos]).strip()
+
+    def tokenize(self, lines):
+        '''разбиение строк на компоненты, генератор (номер строки, список компонентов); пустые строки пропускаются'''
+        for lineno, line in lines:
+            if line == '':
+                continue
+            yield lineno, str.split(line)
+
+    def collect_lines(self, lines, store):
+        '''передача строк дальше по конвейеру с сохранением их текста в список store'''
+        for lineno, line in lines:
+            store.append(line)
+            yield lineno, line
+
+    def parse_data(self, lines):
+        '''разбор секции данных до строки .code, возвращает значения ячеек памяти данных'''
+        data = []  # значения ячеек памяти данных
+        for lineno, line in lines:
+            if line == '.code':
+                return data
+            if line == '':  # пропуск пустых строк
+                continue
+            try:
+                data.append(int(line, 0))
+            except Exception:
+                raise RuntimeError('Синтаксическая ошибка в строке %d.' % lineno)
+        raise RuntimeError('В исходном файле отсутствует программа.')
+
+    def encode(self, tokens):
+        '''кодирование команд за один проход (ссылки вперед на метки проставляются бэкпатчингом),
+        tokens - последовательность (номер строки, компоненты команды), возвращает программу в машинных кодах'''
         commands = {v[0]: k for k, v in self.kops.items()}  # словарь имен команд {имя: код}
+        cmem_size = self.proc.profile.cmem_size
+        wide_jumps = cmem_size is not None and cmem_size > 0x100  # адрес перехода вперед - в слове расширения
         labels = {}  # словарь меток программы {метка: адрес метки}
         labels_to_patch = {}  # словарь неопределенных меток для бэкпатчинга {адрес команды перехода к метке: метка}
+        jumps = []  # адреса команд перехода к меткам
         prog = []  # программа в машинных кодах процессора
-        for idx in range(code_section_start_idx, len(asmprog)):
-            if asmprog[idx] == '':  # пропуск пустых строк
-                continue
+        lines = []  # номера строк исходного текста команд
+        for lineno, asmcmd in tokens:  # asmcmd - компоненты asm команды
             cmd = int(0)  # текущая команда в машинных кодах
-            asmcmd = str.split(asmprog[idx])  # разбиение asm команды на компоненты
+            ext = []  # слова расширения текущей команды
             if len(asmcmd) < 1:
-                raise RuntimeError('Синтаксическая ошибка в строке %d.' % (idx + 1))
+                raise RuntimeError('Синтаксическая ошибка в строке %d.' % lineno)
             if asmcmd[0].strip().endswith(':'):  # обработка метки команды
                 label = asmcmd[0].replace(':', '')  # получение имени метки
                 if label in labels:
-                    raise RuntimeError('Синтаксическая ошибка в строке %d. Повторное объявление метки.' % (idx + 1))
+                    raise RuntimeError('Синтаксическая ошибка в строке %d. Повторное объявление метки.' % lineno)
                 labels[label] = len(prog)  # сохранение адреса метки
                 asmcmd.remove(asmcmd[0])  # удаление метки для дальнейшего разбора команды
             if len(asmcmd) < 1:
-                raise RuntimeError('Синтаксическая ошибка в строке %d.' % (idx + 1))
+                raise RuntimeError('Синтаксическая ошибка в строке %d.' % lineno)
             if str.upper(asmcmd[0]) not in commands:
-                raise RuntimeError('Синтаксическая ошибка в строке %d. Неизвестная команда.' % (idx + 1))
+                raise RuntimeError('Синтаксическая ошибка в строке %d. Неизвестная команда.' % lineno)
             kop = commands[str.upper(asmcmd[0])]  # код команды
             cmd |= kop << 26  # запись кода команды
             opcount = self.kops[kop][2]  # количество операндов команды
@@ -158,180 +659,467 @@ class CmdProcessor(object):
                 if asmcmd[0].upper().startswith('J'):  # обработка команды перехода
                     if opcount != len(asmcmd) - 1:  # неверное количество операндов
                         raise RuntimeError(
-                            'Синтаксическая ошибка в строке %d. Некорректное количество операндов.' % (idx + 1))
+                            'Синтаксическая ошибка в строке %d. Некорректное количество операндов.' % lineno)
+                    jumps.append(len(prog))
                     if asmcmd[1] in labels:  # если адрес метки уже сохранен
                         cmd |= self.optypes['I'] << 24  # запись типа операнда команды перехода
-                        cmd |= labels[asmcmd[1]] << 8  # запись операнда - адреса перехода к метке
+                        cmd |= self.encode_operand(labels[asmcmd[1]], 1, ext)  # запись адреса перехода к метке
                     else:  # добавление команды в словарь для бэкпатчинга
                         labels_to_patch[len(prog)] = asmcmd[1]
+                        if wide_jumps:  # место под адрес перехода в слове расширения
+                            cmd |= EXT_OP1
+                            ext.append(0)
                 else:
                     # обработка остальных команд
                     if opcount != len(asmcmd) - 2:  # неверное количество операндов
                         raise RuntimeError(
-                            'Синтаксическая ошибка в строке %d. Некорректное количество операндов.' % (idx + 1))
+                            'Синтаксическая ошибка в строке %d. Некорректное количество операндов.' % lineno)
                     if len(asmcmd[1]) != opcount:
                         raise RuntimeError(
                             'Синтаксическая ошибка в строке %d. Некорректный идентификатор типов операндов.' %
-                            (idx + 1))
+                            lineno)
                     if asmcmd[1][0] not in self.kops[kop][3]:
                         raise RuntimeError(
                             'Синтаксическая ошибка в строке %d. Некорректный идентификатор типа первого операнда.' %
-                            (idx + 1))
+                            lineno)
                     cmd |= self.optypes[asmcmd[1][0]] << 24  # запись типа первого операнда
-                    if not str.isdecimal(asmcmd[2]):
+                    if not str.isdecimal(asmcmd[2]) or int(asmcmd[2]) > 0xffffffff:
                         raise RuntimeError(
-                            'Синтаксическая ошибка в строке %d. Некорректный первый операнд.' % (idx + 1))
-                    cmd |= int(asmcmd[2]) << 8  # запись первого операнда
+                            'Синтаксическая ошибка в строке %d. Некорректный первый операнд.' % lineno)
+                    cmd |= self.encode_operand(int(asmcmd[2]), 1, ext)  # запись первого операнда
                     if opcount == 2:
                         if len(asmcmd[1]) != 2 or asmcmd[1][1] not in self.kops[kop][4]:
                             raise RuntimeError(
                                 'Синтаксическая ошибка в строке %d. Некорректный идентификатор типа второго операнда.' %
-                                (idx + 1))
+                                lineno)
                         cmd |= self.optypes[asmcmd[1][1]] << 22  # запись типа второго операнда
-                        if not str.isdecimal(asmcmd[3]):
+                        if not str.isdecimal(asmcmd[3]) or int(asmcmd[3]) > 0xffffffff:
                             raise RuntimeError(
-                                'Синтаксическая ошибка в строке %d. Некорректный второй операнд.' % (idx + 1))
-                        cmd |= int(asmcmd[3])  # запись второго операнда
+                                'Синтаксическая ошибка в строке %d. Некорректный второй операнд.' % lineno)
+                        cmd |= self.encode_operand(int(asmcmd[3]), 2, ext)  # запись второго операнда
             prog.append(cmd)  # добавление закодированной команды в программу в машинных кодах
+            prog += ext
+            lines += [lineno] * (1 + len(ext))
+        for label in labels_to_patch.values():
+            if label not in labels:
+                raise RuntimeError('Неизвестная метка %s.' % label)
+        if not wide_jumps and cmem_size is None and any(labels[label] > 0xff for label in labels_to_patch.values()):
+            prog, lines = self.widen_jumps(prog, lines, labels, labels_to_patch, jumps)
         if len(labels_to_patch) > 0:  # если есть неопределенные метки
             for addr, label in labels_to_patch.items():  # проход по программе и проставление адресов меток
-                if label not in labels:
-                    raise RuntimeError('Неизвестная метка %s.' % label)
                 cmd = prog[addr]
                 cmd |= self.optypes['I'] << 24  # запись типа операнда команды перехода
-                cmd |= labels[label] << 8  # запись операнда - адреса перехода к метке
+                if cmd & EXT_OP1:  # адрес перехода в слове расширения
+                    prog[addr + 1] = labels[label]
+                elif labels[label] > 0xff:
+                    raise RuntimeError('Адрес метки %s не помещается в команду перехода.' % label)
+                else:
+                    cmd |= labels[label] << 8  # запись операнда - адреса перехода к метке
                 prog[addr] = cmd
+        self.labels = labels
+        self.lines = lines
+        return prog
+
+    def widen_jumps(self, prog, lines, labels, labels_to_patch, jumps):
+        '''перенос адресов переходов к меткам в слова расширения (адрес метки впереди не помещается в команду):
+        за каждой командой перехода без слова расширения вставляется слово, адреса меток и переходов назад
+        пересчитываются; labels и labels_to_patch изменяются, возвращает новые программу и номера строк'''
+        narrow = {addr for addr in jumps if not prog[addr] & EXT_OP1}
+        newaddr = [0] * (len(prog) + 1)  # адреса слов после вставки
+        result, newlines = [], []
+        for addr, cmd in enumerate(prog):
+            newaddr[addr] = len(result)
+            if addr in narrow:
+                result += [(cmd & ~(0xff << 8)) | EXT_OP1, (cmd >> 8) & 0xff]
+                newlines += [lines[addr]] * 2
+            else:
+                result.append(cmd)
+                newlines.append(lines[addr])
+        newaddr[len(prog)] = len(result)
+        for label, addr in labels.items():
+            labels[label] = newaddr[addr]
+        for addr in jumps:
+            if addr not in labels_to_patch:  # переход назад: адрес уже записан, пересчет по новым адресам
+                result[newaddr[addr] + 1] = newaddr[result[newaddr[addr] + 1]]
+        patch = {newaddr[addr]: label for addr, label in labels_to_patch.items()}
+        labels_to_patch.clear()
+        labels_to_patch.update(patch)
+        return result, newlines
+
+    def encode_operand(self, value, opnum, ext):
+        '''поле операнда № opnum команды; значение больше 8 бит переносится в слово расширения (в список ext)'''
+        if value <= 0xff:
+            return value << 8 if opnum == 1 else value
+        ext.append(value)
+        return EXT_OP1 if opnum == 1 else EXT_OP2
+
+    def disassemble(self, cmd, ext=()):
+        '''перевод команды cmd в машинном коде (ext - ее слова расширения) в текст на языке ассемблера'''
+        kop = (cmd >> 26) & 0x3f
+        if kop not in self.kops:
+            return '??? %#010x' % cmd
+        name, opcount = self.kops[kop][0].lower(), self.kops[kop][2]
+        modes = {v: k for k, v in self.optypes.items()}  # мнемоники типов операнда по кодам
+        ext = list(ext)
+        mode1, op1 = modes[(cmd >> 24) & 0b11], ext.pop(0) if cmd & EXT_OP1 and ext else (cmd >> 8) & 0xff
+        mode2, op2 = modes[(cmd >> 22) & 0b11], ext.pop(0) if cmd & EXT_OP2 and ext else cmd & 0xff
+        if opcount == 0:
+            return name
+        if name.startswith('j') and mode1 == 'I':
+            return '%s %d' % (name, op1)
+        if opcount == 1:
+            return '%s %s %d' % (name, mode1, op1)
+        return '%s %s%s %d %d' % (name, mode1, mode2, op1, op2)
+
+    def assemble(self, asmprog, code_section_start_idx=0):
+        '''перевод программы на языке ассемблера в машинные коды (asmprog - список или итерируемый объект строк)'''
+        lines = itertools.islice(enumerate(asmprog, 1), code_section_start_idx, None)
+        return self.load_program(self.encode(self.tokenize(lines)))
+
+    def load_program(self, prog):
+        '''оптимизация программы в машинных кодах проходами self.passes и запись ее в память процессора'''
+        for optpass in self.passes:
+            prog = optpass(self, prog)
         self.proc.init_cmem(prog)  # запись программы в память процессора
+        self.decode_cmem()  # предекодирование программы
         return prog
 
-    def open_asm_file(self, filename):
+    def parse_source(self, source, keep_source=True):
+        '''потоковый разбор исходного текста source (файл или итерируемый объект строк):
+        чтение строк -> секция данных -> разбиение на компоненты -> кодирование команд.
+        Возвращает текст asm программы (None при keep_source=False) и программу в машинных кодах'''
+        lines = self.read_source(source)
+        lineno, line = next(lines, (0, None))
+        if line is None:
+            raise RuntimeError('Исходный файл пуст.')
+        if line == '.data':  # разбор секции данных
+            self.proc.init_dmem(self.parse_data(lines))
+            line = '.code'
+        if line != '.code':
+            raise RuntimeError('В исходном файле отсутствует программа.')
+        head = list(itertools.islice(lines, 2))  # в секции программы должно быть не менее двух строк
+        if len(head) < 2:
+            raise RuntimeError('В исходном файле отсутствует программа.')
+        code = itertools.chain(head, lines)
+        asmlines = []  # строки asm программы
+        if keep_source:
+            code = self.collect_lines(code, asmlines)
+        mashprog = self.load_program(self.encode(self.tokenize(code)))  # ассемблирование asm программы
+        return (str.join('\n', asmlines) if keep_source else None), mashprog
+
+    def open_asm_file(self, filename, keep_source=True):
         '''чтение asm кода из файла'''
         with open(filename, 'r') as inputFile:  # открытие входного файла
-            src = inputFile.readlines()  # строки исходного файла
-            if len(src) == 0:
-                raise RuntimeError('Исходный файл пуст.')
-            src = [line.strip() for line in src]  # удаление символов перевода строк
-
-            # удаление комментариев (# ...)
-            src = [line[0:(len(line) if line.find('#') == -1 else line.find('#'))].strip() for line in src]
-            strptr = 0  # счетчик строк исходного файла
-            if src[strptr] == '.data':  # разбор секции данных
-                i = strptr + 1
-                self.proc.dmem = []
-                while i < len(src) and src[i] != '.code':
-                    if src[i] == '':  # пропуск пустых строк
-                        i += 1
-                        continue
-                    try:
-                        self.proc.dmem.append(int_to_byte(int(src[i], 0)))
-                    except Exception:
-                        raise RuntimeError('Синтаксическая ошибка в строке %d.' % (i + 1))
-                    i += 1
-                strptr = i
-            asmprogram = ''
-            mashprog = []
-            if src[strptr] == '.code':  # разбор секции программы
-                strptr += 1
-                if strptr >= len(src) - 1:
-                    raise RuntimeError('В исходном файле отсутствует программа.')
-                asmprogram = str.join('\n', src[strptr:])  # сохранение текста asm программы
-                mashprog = self.assemble(src, strptr)  # ассемблирование asm программы
-            else:
-                raise RuntimeError('В исходном файле отсутствует программа.')
-            return asmprogram, mashprog
+            return self.parse_source(inputFile, keep_source)
+
+    def snapshot(self):
+        '''снимок состояния процессора (см. Processor.snapshot)'''
+        return self.proc.snapshot()
+
+    def restore(self, snap, share=False):
+        '''восстановление состояния процессора из снимка snap с предекодированием перезагруженной памяти команд
+        (share - см. Processor.restore)'''
+        version = self.proc.cmem_version
+        self.proc.restore(snap, share)
+        if self.proc.cmem_version != version:
+            self.decode_cmem()
+
+    def fork(self, snap=None):
+        '''копия обработчика команд в состоянии снимка snap (по умолчанию - текущем), например для
+        исследования обоих исходов перехода je/jg. Память данных копии разделяет страницы со снимком
+        (PagedCells) и копирует страницу при первой записи в нее, поэтому fork стоит O(количества страниц),
+        а не O(размера памяти)'''
+        profile = self.proc.profile
+        clone = type(self)(predecode=False, storage=self.proc.storage, output=self.output, input=self.input,
+                           profile=MachineProfile(profile.registers, None, profile.cmem_size))  # без памяти профиля
+        clone.proc.profile, clone.predecode = profile, self.predecode  # предекодирование - после restore
+        clone.labels, clone.lines, clone.fuse = dict(self.labels), list(self.lines), self.fuse
+        clone.restore(self.snapshot() if snap is None else snap, share=True)
+        return clone
+
+    def print_state(self, step, cmdproc):
+        '''вывод состояния процессора на экран (приемник трассировки по умолчанию)'''
+        print(cmdproc)
+
+    def print_output(self, value):
+        '''вывод значения команды OUT на экран'''
+        print('Output: %d' % value)
+
+    def read_input(self):
+        '''ввод значения команды IN с клавиатуры'''
+        try:
+            return int(input('Input: '), 0)
+        except ValueError:
+            raise RuntimeError('Некорректное входное значение (pc = %d).' % self.proc.pc)
+
+    def next_input(self, values):
+        '''следующее значение команды IN из итератора values'''
+        try:
+            return next(values)
+        except StopIteration:
+            raise RuntimeError('Нет входных данных для команды IN (pc = %d).' % self.proc.pc)
 
-    def run(self):
-        '''запуск программы на выполнение'''
-        print(self)
-        while not self.proc.halt:
-            self.execute_cmd()
-            print(self)
+    def run(self, trace='step', every=1, sink=None, max_steps=None, timeout=None):
+        '''запуск программы на выполнение, возвращает количество выполненных шагов
+
+        trace - уровень трассировки:
+        'step' - состояние до запуска и после каждых every шагов (и итоговое состояние),
+        'final' - только итоговое состояние,
+        None - без трассировки
+        sink - приемник трассировки, функция (шаг, обработчик команд); по умолчанию вывод на экран
+        max_steps, timeout - ограничение количества шагов и времени выполнения (в секундах)
+        '''
+        if trace not in ('step', 'final', None):
+            raise RuntimeError('Некорректный уровень трассировки %s.' % trace)
+        if sink is None:
+            sink = self.print_state
+        proc = self.proc
+        execute = self.execute_cmd
+        steps = 0
+        if trace is None and max_steps is None and timeout is None:  # быстрый цикл без проверок
+            while not proc.halt:
+                execute()
+                steps += 1
+            return steps
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        tracestep = trace == 'step'
+        if tracestep:
+            sink(steps, self)
+        while not proc.halt:
+            if max_steps is not None and steps >= max_steps:
+                raise RuntimeError('Превышено максимальное количество шагов (%d).' % max_steps)
+            if deadline is not None and steps & 0x3ff == 0 and time.perf_counter() > deadline:
+                raise RuntimeError('Превышено время выполнения программы (%g с).' % timeout)
+            execute()
+            steps += 1
+            if tracestep and steps % every == 0:
+                sink(steps, self)
+        if trace == 'final' or (tracestep and steps % every != 0):
+            sink(steps, self)
+        return steps
+
+    async def run_async(self, inport=None, outport=None, every=1000, max_steps=None):
+        '''асинхронный запуск программы (await cpu.run_async()), возвращает количество выполненных шагов
+
+        Управление передается циклу событий каждые every шагов и при ожидании порта, поэтому в одном
+        процессе могут параллельно выполняться много машин. inport, outport - порты устройств ввода
+        (команда IN) и вывода (команда OUT): asyncio.Queue или объект с тем же интерфейсом; одна очередь
+        может быть портом вывода одной машины и портом ввода другой. Если порт не задан, используется
+        синхронный self.input/self.output.
+        '''
+        import asyncio  # импортируется только при асинхронном выполнении (долгий импорт)
+        proc = self.proc
+        ready = []  # результат операции порта, дождавшейся до выполнения команды
+
+        def read():
+            return ready.pop() if ready else inport.get_nowait()
+
+        def write(value):
+            if ready:  # значение уже передано в порт при ожидании
+                ready.pop()
+                return
+            outport.put_nowait(value)
+
+        saved = self.input, self.output
+        if inport is not None:
+            self.input = read
+        if outport is not None:
+            self.output = write
+        execute = self.execute_cmd
+        steps = 0
+        try:
+            while not proc.halt:
+                if max_steps is not None and steps >= max_steps:
+                    raise RuntimeError('Превышено максимальное количество шагов (%d).' % max_steps)
+                if inport is not None and inport.empty() or outport is not None and outport.full():
+                    operation = self.port_wait(inport, outport)
+                    if operation is not None:
+                        ready.append(await operation)
+                execute()
+                steps += 1
+                if steps % every == 0:
+                    await asyncio.sleep(0)
+        finally:
+            self.input, self.output = saved
+        return steps
+
+    def port_wait(self, inport, outport):
+        '''операция порта, которую нужно дождаться до выполнения команды по адресу pc (None - не нужно):
+        чтение из пустого порта ввода для IN, запись значения OUT в заполненный порт вывода. Команда
+        выполняется один раз после ожидания, поэтому обработчики, подмененные профилировщиком и
+        отладчиком, не учитывают невыполненных попыток'''
+        proc = self.proc
+        fields = self.fetch(proc.pc) if 0 <= proc.pc < len(proc.cmem) else None
+        if fields is None or fields[0] not in self.kops or not self.valid_operands(*fields[:5]):
+            return None  # ошибку сообщит сама команда
+        kop, optype1, op1 = fields[:3]
+        if kop == 0b010001 and inport is not None and inport.empty():
+            return inport.get()
+        if kop == 0b010000 and outport is not None and outport.full():
+            read_value = Processor.read_value_array if proc.storage == 'array' else Processor.read_value
+            try:
+                return outport.put(read_value(proc, op1, optype1))  # чтение в обход профилировщика
+            except IndexError:
+                return None
+        return None
+
+    def decode_cmem(self):
+        '''предекодирование всей памяти команд процессора'''
+        if not self.predecode:
+            return
+        dcache = [self.decode_at(addr) for addr in range(len(self.proc.cmem))]
+        if self.fuse:  # слияние cmp и следующего за ним je/jg в одну суперкоманду
+            for pc in range(len(dcache) - 1):
+                dcache[pc] = self.fuse_records(dcache[pc], dcache[pc + 1])
+        self.proc.dcache = dcache
+
+    def fuse_records(self, rec, nxt):
+        '''запись суперкоманды cmp + je/jg из предекодированных записей rec и следующей за ней nxt
+        (rec без изменений, если команды не сливаются)'''
+        jump = getattr(nxt[0], 'handler', nxt[0])  # обработчик перехода без учета слов расширения
+        if rec[0] == self.cmp_handler and jump in (self.je_handler, self.jg_handler) and nxt[1] == 0b00:
+            return (self.cmp_jump_handler(nxt[2], 0b00 if jump == self.je_handler else 0b10,
+                                          getattr(nxt[0], 'size', 1)),) + rec[1:]
+        return rec
+
+    def redecode_at(self, addr):
+        '''повторное предекодирование команды по адресу addr после сброса ее записи в кэше
+        (с тем же слиянием cmp + je/jg, что и в decode_cmem)'''
+        rec = self.decode_at(addr)
+        if self.fuse and addr + 1 < len(self.proc.cmem):
+            rec = self.fuse_records(rec, self.decode_at(addr + 1))
+        return rec
+
+    def fetch(self, addr):
+        '''чтение команды по адресу addr со словами расширения, возвращает (код команды, тип операнда1,
+        операнд1, тип операнда2, операнд2, к-во слов команды); None - слова расширения вне памяти команд'''
+        cmem = self.proc.cmem
+        cmd = byte_to_int(cmem[addr], signed=False)
+        op1, op2, size = (cmd >> 8) & 0xff, cmd & 0xff, 1
+        if cmd & (EXT_OP1 | EXT_OP2):
+            if addr + 1 + bool(cmd & EXT_OP1) + bool(cmd & EXT_OP2) > len(cmem):
+                return None
+            if cmd & EXT_OP1:
+                op1 = byte_to_int(cmem[addr + size], signed=False)
+                size += 1
+            if cmd & EXT_OP2:
+                op2 = byte_to_int(cmem[addr + size], signed=False)
+                size += 1
+        return (cmd >> 26) & 0x3f, self.proc.decode_op_type(cmd, 1), op1, self.proc.decode_op_type(cmd, 2), op2, size
+
+    def valid_operands(self, kop, optype1, op1, optype2, op2):
+        '''проверка прямых адресов операндов команды (номеров регистров и ячеек памяти данных)'''
+        for optype, op in ((optype1, op1), (optype2, op2))[:self.kops[kop][2]]:
+            if optype in (0b01, 0b11) and op >= len(self.proc.reg) or optype == 0b10 and op >= len(self.proc.dmem):
+                return False
+        return True
+
+    def decode_at(self, addr):
+        '''декодирование команды по адресу addr памяти команд (со словами расширения) в запись
+        (обработчик, тип операнда1, операнд1, тип операнда2, операнд2); прямые адреса операндов
+        проверяются здесь один раз, при выполнении проверяется только косвенная адресация X'''
+        fields = self.fetch(addr)
+        if fields is None or fields[0] not in self.kops:
+            return self.illegal_handler, 0, 0, 0, 0
+        kop, optype1, op1, optype2, op2, size = fields
+        if not self.valid_operands(kop, optype1, op1, optype2, op2):
+            return self.address_handler, 0, 0, 0, 0
+        handler = self.kops[kop][1] if size == 1 else self.wide_handler(self.kops[kop][1], size)
+        return handler, optype1, op1, optype2, op2
 
     def execute_cmd(self):
         '''выбор и выполнение команды'''
-        cmd = byte_to_int(self.proc.cmem[self.proc.pc], signed=False)  # получение очередной команды
-        kop = (cmd >> 26) & 0x3f  # код команды (6 бит, 31-26)
-        if kop not in self.kops:
-            raise RuntimeError('Некорректный код команды (pc = %d).' % self.proc.pc)
-        self.kops[kop][1](cmd)  # выполнение команды
+        proc = self.proc
+        try:
+            rec = proc.dcache[proc.pc]  # предекодированная команда
+        except IndexError:  # программа без halt или переход за конец памяти команд
+            raise RuntimeError('Выход за границы памяти команд (pc = %d).' % proc.pc)
+        if rec is None:  # команда не декодирована или ячейка памяти команд была перезаписана
+            if self.predecode:
+                rec = proc.dcache[proc.pc] = self.redecode_at(proc.pc)
+            else:
+                rec = self.decode_at(proc.pc)
+        try:
+            rec[0](rec[1], rec[2], rec[3], rec[4])  # выполнение команды
+        except IndexError:  # выход косвенного адреса за границы памяти данных
+            raise RuntimeError('Выход за границы памяти данных (pc = %d).' % proc.pc)
 
-    def nop_handler(self, cmd):
+    def wide_handler(self, handler, size):
+        '''обработчик команды из size слов (со словами расширения): если handler не выполнил переход,
+        pc продвигается за слова расширения'''
+        proc = self.proc
+
+        def wide(optype1, op1, optype2, op2):
+            pc = proc.pc
+            handler(optype1, op1, optype2, op2)
+            if proc.pc == pc + 1:
+                proc.pc = pc + size
+        wide.handler, wide.size = handler, size
+        return wide
+
+    def illegal_handler(self, optype1, op1, optype2, op2):
+        '''обработчик некорректного кода команды'''
+        raise RuntimeError('Некорректный код команды (pc = %d).' % self.proc.pc)
+
+    def address_handler(self, optype1, op1, optype2, op2):
+        '''обработчик команды с некорректным прямым адресом операнда (обнаружен при предекодировании)'''
+        raise RuntimeError('Некорректный адрес операнда (pc = %d).' % self.proc.pc)
+
+    def nop_handler(self, optype1, op1, optype2, op2):
         '''обработчик пустой команды'''
-        pass
+        self.proc.pc += 1
 
-    def mov_handler(self, cmd):
+    def mov_handler(self, optype1, op1, optype2, op2):
         '''обработчик команды пересылки'''
-        optype1 = self.proc.decode_op_type(cmd, 1)  # тип адресации приемника
-        optype2 = self.proc.decode_op_type(cmd, 2)  # тип адресации источника
-        value = self.proc.read_value(cmd & 0xff, optype2)  # извлечение значения (адрес источника/непосредственное)
-        self.proc.write_value((cmd >> 8) & 0xff, value, optype1)  # запись значения в приемник
+        value = self.proc.read_value(op2, optype2)  # извлечение значения (адрес источника/непосредственное)
+        self.proc.write_value(op1, value, optype1)  # запись значения в приемник
         self.proc.pc += 1
 
-    def add_handler(self, cmd):
+    def add_handler(self, optype1, op1, optype2, op2):
         '''обработчик команды сложения (приемник = приемник + источник)'''
-        optype1 = self.proc.decode_op_type(cmd, 1)  # тип адресации приемника
-        optype2 = self.proc.decode_op_type(cmd, 2)  # тип адресации источника
-        value1 = self.proc.read_value((cmd >> 8) & 0xff, optype1)  # извлечение значения приемника
-        value2 = self.proc.read_value(cmd & 0xff, optype2)  # извлечение значения источника/непосредственное значение
-        self.proc.write_value(
-            (cmd >> 8) & 0xff, value1 + value2, optype1)  # запись значения в приемник
+        value1 = self.proc.read_value(op1, optype1)  # извлечение значения приемника
+        value2 = self.proc.read_value(op2, optype2)  # извлечение значения источника/непосредственное значение
+        self.proc.write_value(op1, value1 + value2, optype1)  # запись значения в приемник
         self.proc.pc += 1
 
-    def sub_handler(self, cmd):
+    def sub_handler(self, optype1, op1, optype2, op2):
         '''обработчик команды вычитания (приемник = приемник - источник)'''
-        optype1 = self.proc.decode_op_type(cmd, 1)  # тип адресации приемника
-        optype2 = self.proc.decode_op_type(cmd, 2)  # тип адресации источника
-        value1 = self.proc.read_value((cmd >> 8) & 0xff, optype1)  # извлечение значения приемника
-        value2 = self.proc.read_value(cmd & 0xff, optype2)  # извлечение значения источника/непосредственное значение
-        self.proc.write_value(
-            (cmd >> 8) & 0xff, value1 - value2, optype1)  # запись значения в приемник
+        value1 = self.proc.read_value(op1, optype1)  # извлечение значения приемника
+        value2 = self.proc.read_value(op2, optype2)  # извлечение значения источника/непосредственное значение
+        self.proc.write_value(op1, value1 - value2, optype1)  # запись значения в приемник
         self.proc.pc += 1
 
-    def and_handler(self, cmd):
+    def and_handler(self, optype1, op1, optype2, op2):
         '''обработчик команды побитового И (приемник = приемник & источник)'''
-        optype1 = self.proc.decode_op_type(cmd, 1)  # тип адресации приемника
-        optype2 = self.proc.decode_op_type(cmd, 2)  # тип адресации источника
-        value1 = self.proc.read_value((cmd >> 8) & 0xff, optype1)  # извлечение значения приемника
-        value2 = self.proc.read_value(cmd & 0xff, optype2)  # извлечение значения источника/непосредственное значение
-        self.proc.write_value(
-            (cmd >> 8) & 0xff, value1 & value2, optype1)  # запись значения в приемник
+        value1 = self.proc.read_value(op1, optype1)  # извлечение значения приемника
+        value2 = self.proc.read_value(op2, optype2)  # извлечение значения источника/непосредственное значение
+        self.proc.write_value(op1, value1 & value2, optype1)  # запись значения в приемник
         self.proc.pc += 1
 
-    def or_handler(self, cmd):
+    def or_handler(self, optype1, op1, optype2, op2):
         '''обработчик команды побитового ИЛИ (приемник = приемник | источник)'''
-        optype1 = self.proc.decode_op_type(cmd, 1)  # тип адресации приемника
-        optype2 = self.proc.decode_op_type(cmd, 2)  # тип адресации источника
-        value1 = self.proc.read_value((cmd >> 8) & 0xff, optype1)  # извлечение значения приемника
-        value2 = self.proc.read_value(cmd & 0xff, optype2)  # извлечение значения источника/непосредственное значение
-        self.proc.write_value(
-            (cmd >> 8) & 0xff, value1 | value2, optype1)  # запись значения в приемник
+        value1 = self.proc.read_value(op1, optype1)  # извлечение значения приемника
+        value2 = self.proc.read_value(op2, optype2)  # извлечение значения источника/непосредственное значение
+        self.proc.write_value(op1, value1 | value2, optype1)  # запись значения в приемник
         self.proc.pc += 1
 
-    def xor_handler(self, cmd):
+    def xor_handler(self, optype1, op1, optype2, op2):
         '''обработчик команды побитового исключающего ИЛИ (приемник = приемник ^ источник)'''
-        optype1 = self.proc.decode_op_type(cmd, 1)  # тип адресации приемника
-        optype2 = self.proc.decode_op_type(cmd, 2)  # тип адресации источника
-        value1 = self.proc.read_value((cmd >> 8) & 0xff, optype1)  # извлечение значения приемника
-        value2 = self.proc.read_value(cmd & 0xff, optype2)  # извлечение значения источника/непосредственное значение
-        self.proc.write_value(
-            (cmd >> 8) & 0xff, value1 ^ value2, optype1)  # запись значения в приемник
+        value1 = self.proc.read_value(op1, optype1)  # извлечение значения приемника
+        value2 = self.proc.read_value(op2, optype2)  # извлечение значения источника/непосредственное значение
+        self.proc.write_value(op1, value1 ^ value2, optype1)  # запись значения в приемник
         self.proc.pc += 1
 
-    def not_handler(self, cmd):
+    def not_handler(self, optype1, op1, optype2, op2):
         '''обработчик команды  побитового НЕ (приемник = !приемник)'''
-        optype1 = self.proc.decode_op_type(cmd, 1)  # тип адресации приемника
-        value1 = self.proc.read_value((cmd >> 8) & 0xff, optype1)  # извлечение значения приемника
-        self.proc.write_value(
-            (cmd >> 8) & 0xff, ~value1, optype1)  # запись значения в приемник
+        value1 = self.proc.read_value(op1, optype1)  # извлечение значения приемника
+        self.proc.write_value(op1, ~value1, optype1)  # запись значения в приемник
         self.proc.pc += 1
 
-    def cmp_handler(self, cmd):
+    def cmp_handler(self, optype1, op1, optype2, op2):
         '''обработчик команды сравнения, результат сравнения в регистре reg[0]'''
-        optype1 = self.proc.decode_op_type(cmd, 1)  # тип адресации первого операнда
-        optype2 = self.proc.decode_op_type(cmd, 2)  # тип адресации второго операнда
-        value1 = self.proc.read_value((cmd >> 8) & 0xff, optype1)  # извлечение значения первого операнда
-        value2 = self.proc.read_value(
-            cmd & 0xff, optype2)  # извлечение значения второго операнда/непосредственное значение
+        value1 = self.proc.read_value(op1, optype1)  # извлечение значения первого операнда
+        value2 = self.proc.read_value(op2, optype2)  # извлечение значения второго операнда/непосредственное значение
         if value1 > value2:
             self.proc.write_value(0, 0b10, 0b01)  # >, запись результата сравнения в регистр reg[0]
         elif value1 < value2:
@@ -340,46 +1128,100 @@ class CmdProcessor(object):
             self.proc.write_value(0, 0b00, 0b01)  # ==
         self.proc.pc += 1
 
-    def jmp_handler(self, cmd):
+    def cmp_jump_handler(self, target, condition, size=1):
+        '''создание обработчика суперкоманды cmp + je/jg (переход на target, если результат сравнения condition;
+        size - к-во слов команды перехода)'''
+        proc = self.proc
+
+        def handler(optype1, op1, optype2, op2):
+            value1 = proc.read_value(op1, optype1)  # извлечение значения первого операнда
+            value2 = proc.read_value(op2, optype2)  # извлечение значения второго операнда/непосредственное значение
+            result = 0b10 if value1 > value2 else 0b01 if value1 < value2 else 0b00
+            proc.write_value(0, result, 0b01)  # запись результата сравнения в регистр reg[0]
+            proc.pc = target if result == condition else proc.pc + 1 + size
+        return handler
+
+    def jmp_handler(self, optype1, op1, optype2, op2):
         '''обработчик команды безусловного перехода'''
-        optype1 = self.proc.decode_op_type(cmd, 1)  # тип адресации первого операнда
-        value1 = self.proc.read_value((cmd >> 8) & 0xff, optype1)  # извлечение значения первого операнда
+        value1 = self.proc.read_value(op1, optype1)  # извлечение значения первого операнда
         self.proc.pc = value1
 
-    def je_handler(self, cmd):
+    def je_handler(self, optype1, op1, optype2, op2):
         '''обработчик команды перехода по равенству 0'''
-        optype1 = self.proc.decode_op_type(cmd, 1)  # тип адресации первого операнда
-        value1 = self.proc.read_value((cmd >> 8) & 0xff, optype1)  # извлечение значения первого операнда
+        value1 = self.proc.read_value(op1, optype1)  # извлечение значения первого операнда
         reg0value = self.proc.read_value(0, 0b01)  # значение регистра reg[0]
         if reg0value == 0b00:
             self.proc.pc = value1
         else:
             self.proc.pc += 1
 
-    def jg_handler(self, cmd):
+    def jg_handler(self, optype1, op1, optype2, op2):
         '''обработчик команды перехода по >'''
-        optype1 = self.proc.decode_op_type(cmd, 1)  # тип адресации первого операнда
-        value1 = self.proc.read_value((cmd >> 8) & 0xff, optype1)  # извлечение значения первого операнда
+        value1 = self.proc.read_value(op1, optype1)  # извлечение значения первого операнда
         reg0value = self.proc.read_value(0, 0b01)  # значение регистра reg[0]
         if reg0value == 0b10:
             self.proc.pc = value1
         else:
             self.proc.pc += 1
 
-    def out_handler(self, cmd):
-        '''обработчик команды вывода значения на устойство вывода (на экран)'''
-        optype1 = self.proc.decode_op_type(cmd, 1)  # тип адресации источника
-        value1 = self.proc.read_value((cmd >> 8) & 0xff, optype1)  # извлечение значения источника
-        print('Output: %d' % value1)  # вывод значения
+    def out_handler(self, optype1, op1, optype2, op2):
+        '''обработчик команды вывода значения на устойство вывода (по умолчанию на экран)'''
+        value1 = self.proc.read_value(op1, optype1)  # извлечение значения источника
+        self.output(value1)  # вывод значения
+        self.proc.pc += 1
+
+    def in_handler(self, optype1, op1, optype2, op2):
+        '''обработчик команды ввода значения с устройства ввода (по умолчанию с клавиатуры)'''
+        value = self.input()  # ввод значения до изменения состояния (порт может быть не готов)
+        self.proc.write_value(op1, value, optype1)  # запись значения в приемник
         self.proc.pc += 1
 
-    def halt_handler(self, cmd):
+    def cas_handler(self, optype1, op1, optype2, op2):
+        '''обработчик команды атомарного сравнения с обменом: если значение ячейки приемника равно reg[0],
+        в приемник записывается значение источника и reg[0] = 0 (переход je выполняется), иначе reg[0] = 1'''
+        lock = self.lock
+        if lock is not None:
+            lock.acquire()
+        try:
+            value1 = self.proc.read_value(op1, optype1)  # извлечение значения приемника
+            if value1 == self.proc.read_value(0, 0b01):
+                value2 = self.proc.read_value(op2, optype2)  # извлечение значения источника/непосредственное значение
+                self.proc.write_value(op1, value2, optype1)  # запись значения в приемник
+                self.proc.write_value(0, 0b00, 0b01)
+            else:
+                self.proc.write_value(0, 0b01, 0b01)
+        finally:
+            if lock is not None:
+                lock.release()
+        self.proc.pc += 1
+
+    def fence_handler(self, optype1, op1, optype2, op2):
+        '''обработчик команды барьера памяти: все обращения к памяти до барьера завершаются до обращений после него
+        (при общей памяти нескольких процессов - захват и освобождение блокировки)'''
+        if self.lock is not None:
+            with self.lock:
+                pass
+        self.proc.pc += 1
+
+    def halt_handler(self, optype1, op1, optype2, op2):
         '''обработчик команды останова'''
         self.proc.halt = True
         self.proc.pc += 1
 
 
 if __name__ == '__main__':  # точка входа в программу
+    if len(sys.argv) > 1 and sys.argv[1] == '--batch':  # пакетный режим: python emulator.py --batch файлы...
+        import runner
+        sys.exit(runner.main(sys.argv[2:]))
+    if len(sys.argv) == 3 and sys.argv[1] == '--resume':  # продолжение с контрольной точки: --resume файл_снимка
+        proc = CmdProcessor(None, None)
+        try:
+            proc.restore(Snapshot.load(sys.argv[2]))
+            proc.run(trace='final')
+        except (OSError, RuntimeError) as err:
+            print(err)
+            sys.exit(1)
+        sys.exit(0)
     fileName = ''
     if len(sys.argv) == 2:  # имя исходного файла передано в параметре командной строки
         try:
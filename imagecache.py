@@ -0,0 +1,149 @@
+# Написано на python 3.7
+# Двоичные образы ассемблированных программ и дисковый кэш образов
+# Запуск: python imagecache.py исходный_файл файл_образа (сборка образа для быстрой загрузки)
+import sys  # библиотека, необходимая для обработки параметров командной строки
+import os
+import json
+import mmap
+import struct
+import hashlib
+import tempfile
+from emulator import CmdProcessor
+
+IMAGE_MAGIC = b'EMUI'  # сигнатура файла образа
+IMAGE_VERSION = 2  # версия формата образа
+IMAGE_HEADER = struct.Struct('>4sHHIII')  # сигнатура, версия, флаги, к-во команд, ячеек памяти данных, байт описания
+IMAGE_HAS_DATA = 0b1  # флаг: в исходном файле есть секция .data
+
+
+def image_info(cpu):
+    '''описание программы, загруженной в cpu, для образа: метки, номера строк исходного текста команд
+    и флаг слияния cmp + je/jg (устанавливается проходом оптимизации)'''
+    return {'labels': cpu.labels, 'lines': cpu.lines, 'fuse': cpu.fuse}
+
+
+def save_image(path, program, data=None, info=None):
+    '''запись образа: заголовок, команды ('>I' на команду), память данных ('>i' на значение)
+    и описание программы info (JSON, см. image_info)'''
+    flags = IMAGE_HAS_DATA if data is not None else 0
+    data = data if data is not None else []
+    info = json.dumps(info if info is not None else {}).encode()
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmpname = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as file:  # запись во временный файл и атомарная замена
+        file.write(IMAGE_HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, flags, len(program), len(data), len(info)))
+        file.write(struct.pack('>%dI' % len(program), *program))
+        file.write(struct.pack('>%di' % len(data), *data))
+        file.write(info)
+    os.replace(tmpname, path)
+
+
+def load_image(cpu, path):
+    '''отображение образа path в память и загрузка его в память команд и данных процессора cpu
+    (с метками, номерами строк и флагом слияния из описания), возвращает количество команд программы'''
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if len(mm) < IMAGE_HEADER.size:
+            raise RuntimeError('Некорректный файл образа %s.' % path)
+        magic, version, flags, ncmd, ndata, ninfo = IMAGE_HEADER.unpack_from(mm)
+        if magic != IMAGE_MAGIC or version != IMAGE_VERSION or \
+                len(mm) != IMAGE_HEADER.size + 4 * (ncmd + ndata) + ninfo:
+            raise RuntimeError('Некорректный файл образа %s.' % path)
+        with memoryview(mm) as view:
+            start = IMAGE_HEADER.size
+            cpu.proc.load_cmem_image(view[start:start + 4 * ncmd])
+            if flags & IMAGE_HAS_DATA:
+                cpu.proc.load_dmem_image(view[start + 4 * ncmd:start + 4 * (ncmd + ndata)])
+            info = json.loads(bytes(view[start + 4 * (ncmd + ndata):]).decode()) if ninfo else {}
+    cpu.labels = info.get('labels', {})
+    cpu.lines = info.get('lines', [])
+    cpu.fuse = info.get('fuse', cpu.fuse)
+    cpu.decode_cmem()
+    return ncmd
+
+
+class ImageCache(object):
+    '''дисковый кэш образов программ с ключом по хешу содержимого исходного файла
+
+    Размер каталога ограничен max_bytes; при превышении удаляются давно не использованные образы (LRU по
+    времени изменения файла, которое обновляется при каждом попадании).
+    '''
+    def __init__(self, directory=None, max_bytes=64 << 20):
+        if directory is None:
+            directory = os.environ.get('EMULATOR_CACHE_DIR',
+                                       os.path.join(os.path.expanduser('~'), '.cache', 'assembler-emulator'))
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0  # количество попаданий
+        self.misses = 0  # количество промахов
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, cpu, source):
+        '''ключ образа: хеш исходного текста, версии формата, таблицы кодов команд, профиля машины,
+        проходов оптимизации (функции - по имени, объекты - по repr) и флага слияния cmp + je/jg'''
+        digest = hashlib.sha256()
+        digest.update(b'%d\n' % IMAGE_VERSION)
+        digest.update(repr(sorted((kop, value[0], value[2:]) for kop, value in cpu.kops.items())).encode())
+        digest.update(repr(cpu.proc.profile).encode())
+        digest.update(repr([getattr(optpass, '__module__', '') + '.' + optpass.__qualname__
+                            if hasattr(optpass, '__qualname__') else repr(optpass) for optpass in cpu.passes]).encode())
+        digest.update(b'fuse=%d\n' % cpu.fuse)
+        digest.update(source)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.bin')
+
+    def open_asm_file(self, cpu, filename):
+        '''загрузка программы из файла filename в cpu через кэш, возвращает программу в машинных кодах'''
+        with open(filename, 'rb') as file:
+            source = file.read()
+        path = self.path(self.key(cpu, source))
+        try:
+            load_image(cpu, path)
+            os.utime(path)  # отметка использования для LRU
+            self.hits += 1
+            return [int.from_bytes(bvalue, 'big') for bvalue in cpu.proc.cmem]
+        except (FileNotFoundError, RuntimeError):  # промах или поврежденный образ
+            pass
+        self.misses += 1
+        dmem = cpu.proc.dmem
+        asmprogram, mashprog = cpu.open_asm_file(filename)
+        data = cpu.proc.values(cpu.proc.dmem) if cpu.proc.dmem is not dmem else None  # секция .data прочитана
+        save_image(path, mashprog, data, image_info(cpu))
+        self.evict()
+        return mashprog
+
+    def evict(self):
+        '''удаление давно не использованных образов при превышении размера каталога'''
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.bin'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # образ уже удален другим процессом
+                pass
+            total -= size
+
+
+if __name__ == '__main__':  # точка входа в программу
+    if len(sys.argv) != 3:
+        print('Использование: python imagecache.py исходный_файл файл_образа')
+        sys.exit(1)
+    proc = CmdProcessor(None, None)
+    dmem = proc.proc.dmem
+    try:
+        asmprogram, mashprog = proc.open_asm_file(sys.argv[1])
+    except RuntimeError as err:
+        print(err.args[0])
+        sys.exit(1)
+    save_image(sys.argv[2], mashprog, proc.proc.values(proc.proc.dmem) if proc.proc.dmem is not dmem else None,
+               image_info(proc))
+    print('Образ записан: команд %d, ячеек памяти данных %d' % (len(mashprog), len(proc.proc.dmem)))
@@ -0,0 +1,318 @@
+# Написано на python 3.7
+# Исполнение программы базовыми блоками, скомпилированными в функции python
+import sys  # библиотека, необходимая для обработки параметров командной строки
+import time
+import random
+from emulator import CmdProcessor, byte_to_int, int_to_byte, wrap_int, EXT_OP1, EXT_OP2
+
+
+def indirect_index(addr):
+    '''проверка косвенного адреса памяти данных: отрицательный адрес - выход за границы (IndexError)'''
+    if addr < 0:
+        raise IndexError(addr)
+    return addr
+
+
+class BlockCmdProcessor(CmdProcessor):
+    '''обработчик команд, исполняющий программу базовыми блоками
+
+    Память команд разбивается на базовые блоки по адресам переходов; каждый блок один раз
+    компилируется в функцию python, работающую с целыми числами напрямую (без обработчиков команд
+    и декодирования типов адресации). Переход между блоками - через словарь {pc: блок}.
+    Пошаговое выполнение (execute_cmd, трассировка 'step') и команды, которые не удается
+    скомпилировать, выполняются интерпретатором.
+    '''
+    def __init__(self, program=None, data=None, predecode=True, storage='array', output=None, profile=None,
+                 input=None):
+        super().__init__(program, data, predecode, storage, output, profile, input)
+        self.blocks = {}  # скомпилированные блоки {адрес начала: (функция, к-во команд, {строка: адрес})}
+        self.leaders = set()  # адреса начала базовых блоков
+        self.blocks_version = None  # версия памяти команд, для которой скомпилированы блоки
+
+    def find_leaders(self):
+        '''поиск адресов начала базовых блоков: начало программы, адреса переходов и команды после переходов'''
+        self.leaders = {0}
+        for addr in range(len(self.proc.cmem)):
+            fields = self.fetch(addr)
+            if fields is None or fields[0] not in self.kops:
+                continue
+            kop, optype1, op1, optype2, op2, size = fields
+            name = self.kops[kop][0]
+            if name.startswith('J') or name == 'HALT':
+                self.leaders.add(addr + size)
+                if name.startswith('J') and optype1 == 0b00:
+                    self.leaders.add(op1)
+        self.blocks = {}
+        self.blocks_version = self.proc.cmem_version
+
+    def operand(self, optype, op):
+        '''выражение python для чтения операнда op типа адресации optype'''
+        if self.proc.storage == 'array':
+            return ('%d', 'reg[%d]', 'dmem[%d]', 'dmem[ix(reg[%d])]')[optype] % op
+        return ('%d', 'b2i(reg[%d])', 'b2i(dmem[%d])', 'b2i(dmem[ix(b2i(reg[%d]))])')[optype] % op
+
+    def store(self, optype, op, expr, wrap):
+        '''строки python для записи выражения expr в приемник op типа адресации optype'''
+        target = ('', 'reg[%d]', 'dmem[%d]', 'dmem[ix(reg[%d])]' if self.proc.storage == 'array' else
+                  'dmem[ix(b2i(reg[%d]))]')[optype] % op
+        if self.proc.storage != 'array':
+            return ['%s = i2b(%s)' % (target, expr)]
+        if not wrap:  # результат гарантированно помещается в 32 бита
+            return ['%s = %s' % (target, expr)]
+        return ['v = %s' % expr, '%s = v if -0x80000000 <= v <= 0x7fffffff else wrap(v)' % target]
+
+    def compile_block(self, start):
+        '''компиляция базового блока, начинающегося с адреса start'''
+        lines = []  # строки тела функции блока
+        linemap = {}  # соответствие номеров строк адресам команд
+        ops = {'ADD': '+', 'SUB': '-', 'AND': '&', 'OR': '|', 'XOR': '^'}
+        addr = start
+        count = 0  # количество команд блока
+        end = None  # выражение адреса следующего блока
+        while addr < len(self.proc.cmem) and (addr == start or addr not in self.leaders):
+            fields = self.fetch(addr)
+            if fields is None or fields[0] not in self.kops:  # некорректная команда выполняется интерпретатором
+                break
+            kop, optype1, op1, optype2, op2, size = fields
+            if not self.valid_operands(kop, optype1, op1, optype2, op2):  # ошибка адреса - в интерпретаторе
+                break
+            name = self.kops[kop][0]
+            if name in ('IN', 'CAS', 'FENCE'):  # ввод (в т.ч. ожидание порта) и атомарные - интерпретатором
+                break
+            if name in ('MOV', 'NOT') or name in ops:
+                if optype1 == 0b00:  # запись в непосредственное значение выполняется интерпретатором
+                    break
+            code = []
+            wide = optype2 == 0b00 and op2 > 0x7fffffff  # непосредственное значение из слова расширения
+            if name == 'MOV':
+                code = self.store(optype1, op1, self.operand(optype2, op2), wide)
+            elif name in ops:
+                code = self.store(optype1, op1, '%s %s %s' % (
+                    self.operand(optype1, op1), ops[name], self.operand(optype2, op2)), name in ('ADD', 'SUB') or wide)
+            elif name == 'NOT':
+                code = self.store(optype1, op1, '~%s' % self.operand(optype1, op1), False)
+            elif name == 'CMP':
+                code = ['a = %s' % self.operand(optype1, op1), 'b = %s' % self.operand(optype2, op2)]
+                code += self.store(0b01, 0, '2 if a > b else 1 if a < b else 0', False)
+            elif name == 'OUT':
+                code = ['output(%s)' % self.operand(optype1, op1)]
+            elif name == 'JMP':
+                code = ['return %s' % self.operand(optype1, op1)]
+            elif name in ('JE', 'JG'):
+                code = ['return %s if %s == %d else %d' % (
+                    self.operand(optype1, op1), self.operand(0b01, 0), 0b00 if name == 'JE' else 0b10, addr + size)]
+            elif name == 'HALT':
+                code = ['proc.halt = True', 'return %d' % (addr + size)]
+            for line in code:
+                linemap[len(lines) + 2] = addr  # строка 1 - заголовок функции
+                lines.append(line)
+            addr += size
+            count += 1
+            if name.startswith('J') or name == 'HALT':
+                end = ''
+                break
+        if addr == start:  # блок пуст, команда выполняется интерпретатором
+            return None
+        if end is None:
+            lines.append('return %d' % addr)
+        src = 'def block(proc, reg, dmem, output):\n    ' + str.join('\n    ', lines) + '\n'
+        namespace = {'b2i': byte_to_int, 'i2b': int_to_byte, 'wrap': wrap_int, 'ix': indirect_index}
+        exec(compile(src, '<block %d>' % start, 'exec'), namespace)
+        return namespace['block'], count, linemap
+
+    def get_block(self):
+        '''скомпилированный блок с текущего адреса pc (None - команда выполняется интерпретатором)'''
+        proc = self.proc
+        if self.blocks_version != proc.cmem_version:  # память команд изменилась
+            self.find_leaders()
+        try:
+            return self.blocks[proc.pc]
+        except KeyError:
+            entry = self.compile_block(proc.pc) if 0 <= proc.pc < len(proc.cmem) else None
+            self.blocks[proc.pc] = entry
+            return entry
+
+    def execute_block(self, entry):
+        '''выполнение скомпилированного блока entry, возвращает к-во выполненных команд'''
+        proc = self.proc
+        func, count, linemap = entry
+        try:
+            proc.pc = func(proc, proc.reg, proc.dmem, self.output)
+        except Exception as err:  # pc устанавливается на команду, вызвавшую ошибку
+            tb = err.__traceback__
+            while tb is not None and tb.tb_frame.f_code is not func.__code__:
+                tb = tb.tb_next
+            if tb is not None:
+                proc.pc = linemap[tb.tb_lineno]
+            if isinstance(err, IndexError):  # выход косвенного адреса за границы памяти данных
+                raise RuntimeError('Выход за границы памяти данных (pc = %d).' % proc.pc)
+            raise
+        return count
+
+    def run(self, trace=None, every=1, sink=None, max_steps=None, timeout=None):
+        '''запуск программы на выполнение базовыми блоками, возвращает количество выполненных шагов
+
+        параметры - как у CmdProcessor.run; при трассировке 'step' программа выполняется интерпретатором
+        '''
+        if trace == 'step':
+            return super().run(trace, every, sink, max_steps, timeout)
+        if trace not in ('final', None):
+            raise RuntimeError('Некорректный уровень трассировки %s.' % trace)
+        if sink is None:
+            sink = self.print_state
+        proc = self.proc
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        steps = 0
+        blocks = 0  # счетчик блоков для редкой проверки времени
+        try:
+            while not proc.halt:
+                if max_steps is not None and steps >= max_steps:
+                    raise RuntimeError('Превышено максимальное количество шагов (%d).' % max_steps)
+                if deadline is not None:
+                    blocks += 1
+                    if blocks & 0xff == 0 and time.perf_counter() > deadline:
+                        raise RuntimeError('Превышено время выполнения программы (%g с).' % timeout)
+                entry = self.get_block()
+                if entry is not None and (max_steps is None or steps + entry[1] <= max_steps):
+                    steps += self.execute_block(entry)
+                else:  # команда вне блоков или остаток лимита шагов выполняется интерпретатором
+                    self.execute_cmd()
+                    steps += 1
+        finally:  # блоки пишут в память данных напрямую, минуя учет измененных страниц
+            proc.touch_dmem()
+        if trace == 'final':
+            sink(steps, self)
+        return steps
+
+
+def encode(kop, optype1=0, op1=0, optype2=0, op2=0):
+    '''кодирование команды в машинный код'''
+    return (kop << 26) | (optype1 << 24) | (optype2 << 22) | (op1 << 8) | op2
+
+
+def encode_wide(rng, kop, optype1=0, op1=0, optype2=0, op2=0, extended=False):
+    '''кодирование команды со словами расширения: операнды больше 255 (при extended - и случайные
+    из остальных) записываются в слова расширения после команды; возвращает список слов'''
+    ext1 = op1 > 0xff or extended and rng.random() < 0.05
+    ext2 = op2 > 0xff or extended and rng.random() < 0.05
+    cmd = encode(kop, optype1, 0 if ext1 else op1, optype2, 0 if ext2 else op2)
+    return [cmd | (EXT_OP1 if ext1 else 0) | (EXT_OP2 if ext2 else 0)] + [op1] * ext1 + [op2] * ext2
+
+
+def random_operand(rng, optype, memsize, extended=False):
+    '''случайный операнд типа адресации optype (при extended - также непосредственные значения до 2**32 - 1
+    и некорректные номера регистров и адреса ячеек)'''
+    if optype == 0b00:
+        if extended and rng.random() < 0.3:  # значение в слове расширения, в т.ч. больше 0x7fffffff
+            return rng.choice([rng.randrange(0x100, 0x80000000), rng.randrange(0x80000000, 0x100000000),
+                               0x80000000, 0xffffffff])
+        return rng.randrange(256)
+    if extended and rng.random() < 0.02:  # ошибка адреса, выявляемая при предекодировании
+        return 10 if optype in (0b01, 0b11) else memsize
+    return rng.randrange(10 if optype in (0b01, 0b11) else memsize)
+
+
+def random_program(rng, length=20, memsize=8, extended=False):
+    '''генерация случайной программы в машинных кодах и памяти данных для дифференциального тестирования.
+    extended - также команды IN/CAS/FENCE (базовые блоки передают их интерпретатору), операнды в словах
+    расширения (непосредственные значения больше 0x7fffffff, прямые адреса больше 255 при memsize > 256),
+    некорректные операнды и переходы на слова расширения и за конец программы'''
+    kops = [0b000001, 0b000010, 0b000011, 0b000100, 0b000101, 0b000110, 0b000111,
+            0b001000, 0b001001, 0b001010, 0b001011, 0b010000, 0b000000]
+    if extended:
+        kops += [0b010001, 0b010010, 0b010011]  # IN, CAS, FENCE
+    prog = []
+    for addr in range(length - 1):
+        kop = 0b111110 if rng.random() < 0.02 else rng.choice(kops)  # 0b111110 - некорректный код команды
+        if kop in (0b001001, 0b001010, 0b001011):  # переходы
+            prog += encode_wide(rng, kop, 0b00, rng.randrange(2 * length if extended else length), extended=extended)
+            continue
+        if kop == 0b010011:  # FENCE без операндов
+            prog.append(encode(kop))
+            continue
+        if kop == 0b010010:  # CAS - приемник только в памяти данных
+            optype1 = rng.choice([0b10, 0b11])
+        else:
+            optype1 = rng.choice([0b01, 0b10, 0b11] if kop != 0b001000 else [0b00, 0b01, 0b10, 0b11])
+        optype2 = rng.choice([0b00, 0b01, 0b10, 0b11])
+        op1 = random_operand(rng, optype1, memsize, extended)
+        op2 = random_operand(rng, optype2, memsize, extended)
+        prog += encode_wide(rng, kop, optype1, op1, optype2, op2, extended)
+    prog.append(encode(0b111111))
+    data = [rng.choice([0, 1, 2, 3, rng.randrange(memsize), rng.randrange(-2 ** 31, 2 ** 31)])
+            for idx in range(memsize)]
+    return prog, data
+
+
+def run_state(cpu, max_steps):
+    '''выполнение программы с сохранением итогового состояния (в т.ч. ошибки) для сравнения'''
+    try:
+        steps = cpu.run(trace=None, max_steps=max_steps)
+        error = None
+    except (RuntimeError, IndexError) as err:
+        steps = None
+        error = (type(err).__name__, str(err))
+    proc = cpu.proc
+    return steps, error, proc.pc, proc.halt, proc.values(proc.reg), proc.values(proc.dmem)
+
+
+def differential_check(count=500, seed=0, max_steps=500):
+    '''сравнение исполнения базовыми блоками с интерпретатором на count случайных программах (каждая вторая -
+    с расширенным набором команд и операндов, см. random_program) и на тех же программах после оптимизатора
+    с суперкомандами cmp + je/jg; у оптимизированных программ количество шагов не сравнивается (суперкоманда -
+    один шаг интерпретатора и два шага блока), а запуски, превысившие max_steps, пропускаются.
+    Возвращает список несовпадений (seed программы, хранилище, вариант, состояние интерпретатора, состояние блоков)'''
+    from optimizer import Optimizer
+    failures = []
+    for idx in range(count):
+        rng = random.Random(seed + idx)
+        extended = idx % 2 == 1
+        prog, data = random_program(rng, length=rng.randrange(2, 40), extended=extended,
+                                    memsize=rng.choice([8, 300]) if extended else 8)
+        if not extended:  # пара cmp + je/jg, сливаемая оптимизатором в суперкоманду
+            pos = rng.randrange(len(prog))
+            prog[pos:pos] = [encode(0b001000, 0b01, rng.randrange(10), 0b00, rng.randrange(4)),
+                             encode(rng.choice([0b001010, 0b001011]), 0b00, rng.randrange(len(prog) + 2))]
+        inputs = [rng.randrange(-2 ** 31, 2 ** 31) for value in range(rng.randrange(4))]  # значения команды IN
+        for storage in ('bytes', 'array'):
+            for variant in ('plain', 'optimized'):
+                states = []
+                for cpu_class in (CmdProcessor, BlockCmdProcessor):
+                    out = []
+                    if variant == 'plain':
+                        cpu = cpu_class(prog, data, storage=storage, output=out, input=inputs)
+                    else:
+                        cpu = cpu_class(storage=storage, output=out, input=inputs)
+                        cpu.passes.append(Optimizer())
+                        cpu.load_program(prog)
+                        cpu.proc.init_dmem(data)
+                    states.append(run_state(cpu, max_steps) + (out,))
+                if variant == 'optimized':
+                    if any(state[1] is not None and state[1][1].startswith('Превышено') for state in states):
+                        continue
+                    states = [state[1:] for state in states]
+                if states[0] != states[1]:
+                    failures.append((seed + idx, storage, variant, states[0], states[1]))
+    return failures
+
+
+def bench_loop(cpu_class, length, storage='array'):
+    '''замер количества шагов в секунду на цикле суммирования массива длины length (программа asm1.txt)'''
+    cpu = cpu_class(storage=storage, output=[])
+    cpu.open_asm_file('asm1.txt')
+    cpu.proc.init_dmem([0, length] + list(range(length)))
+    start = time.perf_counter()
+    steps = cpu.run(trace=None)
+    return steps / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':  # точка входа в программу
+    failures = differential_check(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
+    print('Дифференциальная проверка: несовпадений %d' % len(failures))
+    for failure in failures[:5]:
+        print(failure)
+    for storage in ('bytes', 'array'):
+        slow = bench_loop(CmdProcessor, 100000, storage)
+        fast = bench_loop(BlockCmdProcessor, 100000, storage)
+        print('хранилище %s: интерпретатор %.0f шаг/с, базовые блоки %.0f шаг/с (x%.2f)' %
+              (storage, slow, fast, fast / slow))
@@ -0,0 +1,224 @@
+# Написано на python 3.7
+# Оптимизатор программ в машинных кодах (peephole) и проверка эквивалентности оптимизированных программ
+# Запуск: python optimizer.py [исходные файлы...]
+import sys  # библиотека, необходимая для обработки параметров командной строки
+import random
+from emulator import CmdProcessor, EXT_OP1, EXT_OP2
+
+
+class Optimizer(object):
+    '''проход оптимизации программы в машинных кодах (подключается через CmdProcessor.passes):
+    удаление nop, удаление недостижимого кода, свертка mov + add/sub с непосредственными значениями,
+    замена переходов на переходы прямыми переходами и слияние cmp + je/jg в суперкоманду при предекодировании.
+    Адреса переходов (в т.ч. проставленные бэкпатчингом), метки и номера строк пересчитываются.
+    '''
+    def __init__(self, nops=True, dead=True, fold=True, thread=True, fuse=True):
+        self.nops = nops
+        self.dead = dead
+        self.fold = fold
+        self.thread = thread
+        self.fuse = fuse
+        self.stats = {}  # статистика последнего прохода
+
+    def __repr__(self):  # настройки прохода (входят в ключ кэша образов imagecache.py)
+        return 'Optimizer(nops=%r, dead=%r, fold=%r, thread=%r, fuse=%r)' % (
+            self.nops, self.dead, self.fold, self.thread, self.fuse)
+
+    def __call__(self, cpu, prog):
+        '''оптимизация программы prog обработчика команд cpu, возвращает новую программу'''
+        def field(cmd):  # разбор команды (имя, тип операнда1, операнд1, тип операнда2, операнд2)
+            kop = (cmd >> 26) & 0x3f
+            return (cpu.kops[kop][0] if kop in cpu.kops else None,
+                    (cmd >> 24) & 0b11, (cmd >> 8) & 0xff, (cmd >> 22) & 0b11, cmd & 0xff)
+
+        prog = list(prog)
+        if any(cmd & (EXT_OP1 | EXT_OP2) for cmd in prog):  # команды со словами расширения не оптимизируются
+            self.stats = {'before': len(prog), 'after': len(prog), 'nops': 0, 'dead': 0, 'folded': 0,
+                          'threaded': 0, 'fused': 0}
+            return prog
+        code = [field(cmd) for cmd in prog]
+        isjump = [name is not None and name.startswith('J') for name, t1, op1, t2, op2 in code]
+        direct = all(code[pc][1] == 0b00 for pc in range(len(prog)) if isjump[pc])  # все переходы по константам
+        stats = {'before': len(prog), 'nops': 0, 'dead': 0, 'folded': 0, 'threaded': 0, 'fused': 0}
+        if self.thread and direct:  # переход на jmp заменяется переходом сразу на его адрес
+            for pc in range(len(prog)):
+                if not isjump[pc]:
+                    continue
+                target, seen = code[pc][2], {pc}
+                while target < len(prog) and code[target][0] == 'JMP' and target not in seen:
+                    seen.add(target)
+                    target = code[target][2]
+                if target != code[pc][2]:
+                    prog[pc] = (prog[pc] & ~(0xff << 8)) | (target << 8)
+                    code[pc] = field(prog[pc])
+                    stats['threaded'] += 1
+        removed = [False] * len(prog)
+        if self.dead and direct:  # удаление команд, недостижимых из начала программы
+            reachable = [False] * len(prog)
+            stack = [0]
+            while stack:
+                pc = stack.pop()
+                if pc >= len(prog) or reachable[pc]:
+                    continue
+                reachable[pc] = True
+                name = code[pc][0]
+                if isjump[pc]:
+                    stack.append(code[pc][2])
+                if name is not None and name not in ('JMP', 'HALT'):
+                    stack.append(pc + 1)
+            for pc in range(len(prog)):
+                if not reachable[pc]:
+                    removed[pc] = True
+                    stats['dead'] += 1
+        if self.nops:
+            for pc in range(len(prog)):
+                if code[pc][0] == 'NOP' and not removed[pc]:
+                    removed[pc] = True
+                    stats['nops'] += 1
+        if self.fold and direct:  # mov x I a; add/sub x I b -> mov x I (a +/- b)
+            targets = {code[pc][2] for pc in range(len(prog)) if isjump[pc] and not removed[pc]}
+            for pc in range(len(prog)):
+                name, t1, op1, t2, op2 = code[pc]
+                if name != 'MOV' or t2 != 0b00 or removed[pc]:
+                    continue
+                value = op2
+                nxt = pc + 1
+                while nxt < len(prog) and nxt not in targets:  # в т.ч. удаленная команда - цель перехода
+                    if removed[nxt]:
+                        nxt += 1
+                        continue
+                    name2, t12, op12, t22, op22 = code[nxt]
+                    if name2 not in ('ADD', 'SUB') or (t12, op12, t22) != (t1, op1, 0b00):
+                        break
+                    folded = value + op22 if name2 == 'ADD' else value - op22
+                    if not 0 <= folded <= 0xff:  # результат должен помещаться в непосредственный операнд
+                        break
+                    value = folded
+                    removed[nxt] = True
+                    stats['folded'] += 1
+                    nxt += 1
+                if value != op2:
+                    prog[pc] = (prog[pc] & ~0xff) | value
+                    code[pc] = field(prog[pc])
+        # пересчет адресов: удаленная команда отображается на следующую оставшуюся
+        newaddr = [0] * (len(prog) + 1)
+        count = 0
+        for pc in range(len(prog)):
+            newaddr[pc] = count
+            if not removed[pc]:
+                count += 1
+        newaddr[len(prog)] = count
+        result, lines = [], []
+        for pc in range(len(prog)):
+            if removed[pc]:
+                continue
+            cmd = prog[pc]
+            if isjump[pc] and code[pc][1] == 0b00:
+                target = code[pc][2]
+                target = newaddr[target] if target <= len(prog) else target - (len(prog) - count)
+                cmd = (cmd & ~(0xff << 8)) | (target << 8)
+            result.append(cmd)
+            if pc < len(cpu.lines):
+                lines.append(cpu.lines[pc])
+        cpu.labels = {label: newaddr[min(addr, len(prog))] for label, addr in cpu.labels.items()}
+        cpu.lines = lines
+        if self.fuse:
+            cpu.fuse = True
+            names = [field(cmd)[0] for cmd in result]
+            stats['fused'] = sum(1 for pc in range(len(result) - 1)
+                                 if names[pc] == 'CMP' and names[pc + 1] in ('JE', 'JG'))
+        stats['after'] = len(result)
+        self.stats = stats
+        return result
+
+    def report(self):
+        '''текстовый отчет о последнем проходе оптимизации'''
+        stats = self.stats
+        return ('команд: %d -> %d (-%d); удалено nop: %d, недостижимых: %d, свернуто add/sub: %d; '
+                'переходов на переходы: %d; суперкоманд cmp+je/jg: %d' % (
+                    stats['before'], stats['after'], stats['before'] - stats['after'], stats['nops'],
+                    stats['dead'], stats['folded'], stats['threaded'], stats['fused']))
+
+
+def run_result(cpu, data, max_steps):
+    '''результат выполнения для сравнения (значения OUT, регистры, память данных, тип ошибки);
+    None - превышен лимит шагов (оптимизированная программа выполняет меньше шагов, сравнение невозможно)'''
+    out = []
+    cpu.output = out.append
+    cpu.proc.init_dmem(data)
+    cpu.proc.reg = cpu.proc.new_cells(len(cpu.proc.reg))
+    cpu.proc.pc = 0
+    cpu.proc.halt = False
+    error = None
+    try:
+        cpu.run(trace=None, max_steps=max_steps)
+    except RuntimeError as err:
+        if str(err).startswith('Превышено'):
+            return None
+        error = 'RuntimeError'
+    except IndexError:
+        error = 'IndexError'
+    return out, cpu.proc.values(cpu.proc.reg), cpu.proc.values(cpu.proc.dmem), error
+
+
+def equivalent(prog, datasets, max_steps=100000):
+    '''сравнение исходной и оптимизированной программы prog на наборах данных datasets,
+    возвращает (к-во сравненных запусков, список несовпадающих наборов данных, оптимизатор)'''
+    reference = CmdProcessor(prog, storage='array')
+    optimizer = Optimizer()
+    optimized = CmdProcessor(storage='array')
+    optimized.passes.append(optimizer)
+    optimized.load_program(prog)
+    compared, failures = 0, []
+    for data in datasets:
+        result1 = run_result(reference, data, max_steps)
+        result2 = run_result(optimized, data, max_steps)
+        if result1 is None or result2 is None:
+            continue
+        compared += 1
+        if result1 != result2:
+            failures.append(data)
+    return compared, failures, optimizer
+
+
+def check_files(filenames, trials=100, seed=0):
+    '''проверка эквивалентности на исходных файлах с их данными и случайными наборами данных'''
+    rng = random.Random(seed)
+    for filename in filenames:
+        cpu = CmdProcessor()
+        asmprogram, mashprog = cpu.open_asm_file(filename)
+        data = cpu.proc.values(cpu.proc.dmem)
+        datasets = [data] + [[rng.randrange(-3, len(data)) for value in data] for idx in range(trials)]
+        compared, failures, optimizer = equivalent(mashprog, datasets)
+        print('%s: %s; сравнено запусков %d, несовпадений %d' % (filename, optimizer.report(), compared,
+                                                                len(failures)))
+
+
+def check_random(count=300, seed=0):
+    '''проверка эквивалентности на случайных программах, возвращает количество несовпадений'''
+    from jit import random_program
+    mismatches = 0
+    for idx in range(count):
+        rng = random.Random(seed + idx)
+        prog, data = random_program(rng, length=rng.randrange(2, 40))
+        if rng.random() < 0.5:  # вставка пар mov + add/sub для проверки свертки
+            pos = rng.randrange(len(prog))
+            prog[pos:pos] = [(0b000001 << 26) | (0b01 << 24) | (1 << 8) | rng.randrange(100),
+                             (0b000010 << 26) | (0b01 << 24) | (1 << 8) | rng.randrange(100)]
+        if rng.random() < 0.3:  # mov; L: nop; add; ...; jmp L - переход на удаляемый nop между mov и add
+            pos = rng.randrange(len(prog))
+            prog[pos:pos] = [(0b000001 << 26) | (0b01 << 24) | (1 << 8) | rng.randrange(100),  # mov RI 1 a
+                             0,  # L: nop
+                             (0b000010 << 26) | (0b01 << 24) | (1 << 8) | rng.randrange(100),  # add RI 1 b
+                             (0b001000 << 26) | (0b01 << 24) | (1 << 8) | 50,  # cmp RI 1 50
+                             (0b001011 << 26) | ((pos + 7) << 8),  # jg pos + 7
+                             (0b000001 << 26) | (0b01 << 24) | (1 << 8) | 100,  # mov RI 1 100
+                             (0b001001 << 26) | ((pos + 1) << 8)]  # jmp L
+        compared, failures, optimizer = equivalent(prog, [data], max_steps=2000)
+        mismatches += len(failures)
+    return mismatches
+
+
+if __name__ == '__main__':  # точка входа в программу
+    check_files(sys.argv[1:] if len(sys.argv) > 1 else ['asm1.txt', 'asm2.txt', 'asm3.txt'])
+    print('Случайные программы: несовпадений %d' % check_random())
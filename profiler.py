@@ -0,0 +1,184 @@
+# Написано на python 3.7
+# Профилировщик программ эмулятора: счетчики команд, ветвлений и обращений к памяти данных
+# Запуск: python profiler.py исходный_файл
+import sys  # библиотека, необходимая для обработки параметров командной строки
+from collections import Counter
+from emulator import CmdProcessor, byte_to_int
+
+
+class Profiler(object):
+    '''профилировщик обработчика команд cpu
+
+    При включении (enable) подменяет у cpu метод execute_cmd, обработчики je/jg в таблице кодов команд
+    и методы чтения/записи процессора на считающие версии; при выключении (disable) восстанавливает
+    исходные, поэтому выключенный профилировщик ничего не стоит. Профилируется выполнение через
+    execute_cmd (интерпретатор); базовые блоки BlockCmdProcessor счетчиками не охватываются.
+    '''
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        '''обнуление счетчиков'''
+        self.counts = Counter()  # количество выполнений команды {адрес: к-во}
+        self.taken = Counter()  # количество выполненных переходов je/jg {адрес: к-во}
+        self.not_taken = Counter()  # количество невыполненных переходов je/jg {адрес: к-во}
+        self.reads = Counter()  # количество чтений ячейки памяти данных {номер ячейки: к-во}
+        self.writes = Counter()  # количество записей ячейки памяти данных {номер ячейки: к-во}
+
+    def enable(self):
+        '''включение профилирования (подмена методов cpu на считающие)'''
+        if self.enabled:
+            return
+        cpu, proc = self.cpu, self.cpu.proc
+        self.saved = (cpu.__dict__.get('execute_cmd'), proc.__dict__.get('read_value'),
+                      proc.__dict__.get('write_value'), dict(cpu.kops))
+        execute_cmd, read_value, write_value = cpu.execute_cmd, proc.read_value, proc.write_value
+        counts, reads, writes = self.counts, self.reads, self.writes
+
+        def profiled_execute_cmd():
+            counts[proc.pc] += 1
+            execute_cmd()
+
+        def profiled_read_value(src, optype):
+            if optype == 0b10:
+                reads[src] += 1
+            elif optype == 0b11:
+                reads[read_value(src, 0b01)] += 1
+            return read_value(src, optype)
+
+        def profiled_write_value(dst, value, optype):
+            if optype == 0b10:
+                writes[dst] += 1
+            elif optype == 0b11:
+                writes[read_value(dst, 0b01)] += 1
+            write_value(dst, value, optype)
+
+        def profiled_branch(handler, condition):
+            def branch(optype1, op1, optype2, op2):
+                pc = proc.pc
+                taken = read_value(0, 0b01) == condition  # значение регистра reg[0] до перехода
+                handler(optype1, op1, optype2, op2)
+                (self.taken if taken else self.not_taken)[pc] += 1
+            return branch
+
+        cpu.execute_cmd = profiled_execute_cmd
+        proc.read_value = profiled_read_value
+        proc.write_value = profiled_write_value
+        for kop, value in cpu.kops.items():  # подмена обработчиков переходов в таблице кодов команд
+            if value[0] in ('JE', 'JG'):
+                cpu.kops[kop] = (value[0], profiled_branch(value[1], 0b00 if value[0] == 'JE' else 0b10)) + value[2:]
+        cpu.decode_cmem()
+        self.enabled = True
+
+    def disable(self):
+        '''выключение профилирования (восстановление исходных методов cpu)'''
+        if not self.enabled:
+            return
+        cpu, proc = self.cpu, self.cpu.proc
+        execute_cmd, read_value, write_value, kops = self.saved
+        for obj, name, value in ((cpu, 'execute_cmd', execute_cmd), (proc, 'read_value', read_value),
+                                 (proc, 'write_value', write_value)):
+            if value is None:
+                del obj.__dict__[name]
+            else:
+                setattr(obj, name, value)
+        cpu.kops.clear()
+        cpu.kops.update(kops)
+        cpu.decode_cmem()
+        self.enabled = False
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.disable()
+
+    def opcode_counts(self):
+        '''количество выполнений по кодам команд {имя команды: к-во}'''
+        result = Counter()
+        for pc, count in self.counts.items():
+            kop = (byte_to_int(self.cpu.proc.cmem[pc], signed=False) >> 26) & 0x3f
+            result[self.cpu.kops[kop][0] if kop in self.cpu.kops else '???'] += count
+        return result
+
+    def commands(self):
+        '''команды памяти команд по порядку (слова расширения пропускаются), генератор (адрес, список слов команды)'''
+        cpu = self.cpu
+        pc = 0
+        while pc < len(cpu.proc.cmem):
+            fields = cpu.fetch(pc)
+            size = 1 if fields is None else fields[5]
+            yield pc, [byte_to_int(bvalue, signed=False) for bvalue in cpu.proc.cmem[pc:pc + size]]
+            pc += size
+
+    def loops(self):
+        '''циклы (обратные переходы), список (к-во команд в теле, к-во итераций, начало, конец) по убыванию'''
+        result = []
+        for pc in set(self.counts):
+            fields = self.cpu.fetch(pc)  # адрес перехода может быть в слове расширения
+            if fields is None or fields[0] not in self.cpu.kops or not self.cpu.kops[fields[0]][0].startswith('J'):
+                continue
+            kop, target = fields[0], fields[2]
+            if target > pc:  # переход вперед
+                continue
+            iterations = self.taken[pc] if self.cpu.kops[kop][0] != 'JMP' else self.counts[pc]
+            body = sum(self.counts[addr] for addr in range(target, pc + 1))
+            result.append((body, iterations, target, pc))
+        return sorted(result, reverse=True)
+
+    def listing(self, source=None):
+        '''аннотированный листинг: счетчики выполнения и ветвлений по командам с метками и строками исходного
+        текста source (список строк файла; если не задан - дизассемблированные команды)'''
+        cpu = self.cpu
+        labels = {}  # метки по адресам
+        for label, addr in cpu.labels.items():
+            labels.setdefault(addr, []).append(label)
+        total = sum(self.counts.values()) or 1
+        lines = ['%6s %10s %6s %14s  %s' % ('адрес', 'выполнений', '%', 'переходы', 'команда')]
+        for pc, words in self.commands():
+            text = cpu.disassemble(words[0], words[1:])
+            if source is not None and pc < len(cpu.lines) and cpu.lines[pc] <= len(source):
+                text = '%4d: %s' % (cpu.lines[pc], source[cpu.lines[pc] - 1].rstrip())
+            branches = ''
+            if pc in self.taken or pc in self.not_taken:
+                branches = '%d/%d' % (self.taken[pc], self.not_taken[pc])
+            if pc in labels:
+                lines.append('%s:' % str.join(', ', labels[pc]))
+            lines.append('%6d %10d %6.2f %14s  %s' % (pc, self.counts[pc], 100 * self.counts[pc] / total, branches, text))
+        return str.join('\n', lines)
+
+    def report(self, source=None, top=5):
+        '''полный отчет: листинг, счетчики по кодам команд, горячие циклы и обращения к памяти данных'''
+        cpu = self.cpu
+        labels = {addr: label for label, addr in cpu.labels.items()}
+        s = 'Листинг (переходы: выполнено/не выполнено):\n%s\n' % self.listing(source)
+        s += '\nКоманды по кодам:\n'
+        for name, count in self.opcode_counts().most_common():
+            s += '  %-6s %d\n' % (name, count)
+        s += '\nГорячие циклы:\n'
+        for body, iterations, start, end in self.loops()[:top]:
+            s += '  %d-%d%s: итераций %d, выполнено команд %d\n' % (
+                start, end, ' (%s)' % labels[start] if start in labels else '', iterations, body)
+        s += '\nОбращения к памяти данных (ячейка: чтений/записей):\n'
+        for cell in sorted(set(self.reads) | set(self.writes)):
+            s += '  mem[%d]: %d/%d\n' % (cell, self.reads[cell], self.writes[cell])
+        return s
+
+
+if __name__ == '__main__':  # точка входа в программу
+    if len(sys.argv) != 2:
+        print('Использование: python profiler.py исходный_файл')
+        sys.exit(1)
+    proc = CmdProcessor(storage='array')
+    try:
+        proc.open_asm_file(sys.argv[1])
+        with Profiler(proc) as profiler:
+            proc.run(trace=None)
+    except RuntimeError as err:
+        print(err.args[0])
+        sys.exit(1)
+    with open(sys.argv[1], 'r') as inputFile:
+        print(profiler.report(inputFile.readlines()))
@@ -0,0 +1,119 @@
+# Написано на python 3.7
+# Пакетный запуск множества asm файлов в пуле процессов с общим отчетом
+# Запуск: python runner.py [параметры] файлы/каталоги/шаблоны... (или python emulator.py --batch ...)
+import sys  # библиотека, необходимая для обработки параметров командной строки
+import os
+import csv
+import glob
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from emulator import CmdProcessor
+
+REPORT_FIELDS = ('file', 'status', 'steps', 'output', 'reg', 'dmem', 'error')  # столбцы отчета CSV
+
+
+def find_files(paths, patterns=('*.asm', '*.txt')):
+    '''список исходных файлов по именам файлов, каталогам (рекурсивно по шаблонам patterns) и glob-шаблонам'''
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for pattern in patterns:
+                files += sorted(glob.glob(os.path.join(path, '**', pattern), recursive=True))
+        else:
+            matches = sorted(glob.glob(path, recursive=True))
+            files += matches if matches else [path]  # несуществующий файл попадет в отчет с ошибкой
+    return list(dict.fromkeys(files))  # удаление повторов с сохранением порядка
+
+
+def run_file(filename, max_steps=None, timeout=None, engine='interp', cache_dir=None):
+    '''ассемблирование и выполнение одной программы, результат - словарь для отчета (ошибки не пробрасываются)'''
+    result = {'file': filename, 'status': 'ok', 'steps': None, 'output': [], 'reg': None, 'dmem': None,
+              'error': None}
+    try:
+        if engine == 'block':
+            from jit import BlockCmdProcessor
+            proc = BlockCmdProcessor(output=result['output'])
+        else:
+            proc = CmdProcessor(storage='array', output=result['output'])
+        if cache_dir is not None:  # программа берется из кэша образов без повторного ассемблирования
+            from imagecache import ImageCache
+            ImageCache(cache_dir).open_asm_file(proc, filename)
+        else:
+            proc.open_asm_file(filename)
+        try:
+            result['steps'] = proc.run(trace=None, max_steps=max_steps, timeout=timeout)
+        finally:
+            result['reg'] = proc.proc.values(proc.proc.reg)
+            result['dmem'] = proc.proc.values(proc.proc.dmem)
+    except Exception as err:  # ошибка одной программы не прерывает пакет
+        result['status'] = 'error'
+        result['error'] = '%s: %s' % (type(err).__name__, err)
+    return result
+
+
+class ReportWriter(object):
+    '''потоковая запись отчета (JSON lines или CSV) по мере завершения программ'''
+    def __init__(self, file, fmt='jsonl'):
+        if fmt not in ('jsonl', 'csv'):
+            raise RuntimeError('Некорректный формат отчета %s.' % fmt)
+        self.file = file
+        self.fmt = fmt
+        if fmt == 'csv':
+            self.writer = csv.DictWriter(file, REPORT_FIELDS)
+            self.writer.writeheader()
+
+    def write(self, result):
+        if self.fmt == 'jsonl':
+            self.file.write(json.dumps(result, ensure_ascii=False) + '\n')
+        else:
+            row = dict(result)
+            for key in ('output', 'reg', 'dmem'):
+                row[key] = '' if row[key] is None else str.join(' ', map(str, row[key]))
+            self.writer.writerow(row)
+        self.file.flush()
+
+
+def run_batch(files, report, workers=None, max_steps=None, timeout=None, engine='interp', cache_dir=None):
+    '''выполнение файлов в пуле процессов с записью результатов в report по мере завершения,
+    возвращает количество программ, завершившихся с ошибкой'''
+    errors = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_file, filename, max_steps, timeout, engine, cache_dir) for filename in files]
+        for future in as_completed(futures):
+            result = future.result()
+            report.write(result)
+            if result['status'] != 'ok':
+                errors += 1
+    return errors
+
+
+def main(argv=None):
+    '''пакетный режим командной строки, возвращает код завершения (1 - были ошибки)'''
+    parser = argparse.ArgumentParser(description='Пакетный запуск программ эмулятора.')
+    parser.add_argument('paths', nargs='+', help='исходные файлы, каталоги или glob-шаблоны')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='количество процессов')
+    parser.add_argument('--max-steps', type=int, default=1000000, help='ограничение шагов на программу')
+    parser.add_argument('--timeout', type=float, default=None, help='ограничение времени на программу, с')
+    parser.add_argument('--engine', choices=('interp', 'block'), default='interp', help='способ выполнения')
+    parser.add_argument('--cache', default=None, help='каталог кэша ассемблированных образов')
+    parser.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl', help='формат отчета')
+    parser.add_argument('-o', '--output', default=None, help='файл отчета (по умолчанию - вывод на экран)')
+    args = parser.parse_args(argv)
+    files = find_files(args.paths)
+    if len(files) == 0:
+        print('Ошибка: не найдено ни одного исходного файла', file=sys.stderr)
+        return 1
+    if args.output is None:
+        errors = run_batch(files, ReportWriter(sys.stdout, args.format), args.workers, args.max_steps,
+                           args.timeout, args.engine, args.cache)
+    else:
+        with open(args.output, 'w', newline='', encoding='utf-8') as file:
+            errors = run_batch(files, ReportWriter(file, args.format), args.workers, args.max_steps,
+                               args.timeout, args.engine, args.cache)
+    print('Выполнено программ: %d, с ошибкой: %d' % (len(files), errors), file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':  # точка входа в программу
+    sys.exit(main())
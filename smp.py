@@ -0,0 +1,290 @@
+# Написано на python 3.7
+# Многоядерная машина: несколько ядер (CmdProcessor) с собственными регистрами и pc и общей памятью данных
+# Запуск: python smp.py [размер массива] [к-во ядер...] (проверка и замер параллельного суммирования массива)
+import sys  # библиотека, необходимая для обработки параметров командной строки
+import time
+import queue
+import random
+import multiprocessing
+from array import array
+from emulator import CmdProcessor, MachineProfile
+
+
+class SmpMachine(object):
+    '''многоядерная машина: cores ядер с общей памятью данных (хранилище 'array')
+
+    Номер ядра перед запуском записывается в последний регистр, количество ядер - в предпоследний.
+    run - детерминированное поочередное выполнение ядер квантами по quantum команд в одном процессе,
+    run_parallel - параллельное выполнение ядер в отдельных процессах ОС над общей памятью
+    (multiprocessing.shared_memory); атомарность CAS между процессами обеспечивается общей блокировкой.
+    Значения, выведенные командой OUT, собираются по ядрам в списки outputs.
+    '''
+    def __init__(self, cores=2, profile=None):
+        if cores < 1:
+            raise RuntimeError('Некорректное количество ядер %d.' % cores)
+        self.profile = profile if profile is not None else MachineProfile()  # профиль машины (общий для ядер)
+        self.outputs = [[] for idx in range(cores)]  # значения, выведенные ядрами
+        self.cores = [CmdProcessor(storage='array', output=self.outputs[idx], profile=self.profile)
+                      for idx in range(cores)]
+        self.program = self.cores[0].load_program([0b11111100_00000000_00000000_00000000])  # программа в машинных кодах
+        self.share()
+
+    @property
+    def dmem(self):
+        '''общая память данных'''
+        return self.cores[0].proc.dmem
+
+    def share(self):
+        '''подключение всех ядер к памяти данных и программе ядра 0, сброс состояния ядер'''
+        for core in self.cores[1:]:
+            core.proc.dmem = self.dmem
+            core.load_program(self.program)  # предекодирование с проверкой адресов по общей памяти данных
+        self.reset()
+
+    def reset(self):
+        '''сброс регистров, pc и выведенных значений ядер (память данных не изменяется)'''
+        for idx, core in enumerate(self.cores):
+            core.proc.reg = core.proc.new_cells(self.profile.registers)
+            core.proc.reg[-1] = idx  # номер ядра
+            core.proc.reg[-2] = len(self.cores)  # количество ядер
+            core.proc.pc = 0
+            core.proc.halt = False
+            del self.outputs[idx][:]
+
+    def init_dmem(self, data):
+        '''запись значений data в общую память данных'''
+        self.cores[0].proc.init_dmem(data)
+        self.cores[0].decode_cmem()
+        self.share()
+
+    def parse_source(self, source):
+        '''разбор исходного текста source (секция .data записывается в общую память данных)'''
+        self.program = self.cores[0].parse_source(source, keep_source=False)[1]
+        self.share()
+        return self.program
+
+    def open_asm_file(self, filename):
+        '''чтение asm кода из файла'''
+        with open(filename, 'r') as inputFile:
+            return self.parse_source(inputFile)
+
+    def run(self, quantum=100, max_steps=None):
+        '''детерминированное выполнение: ядра по очереди выполняют по quantum команд (остановленные
+        пропускаются) до останова всех ядер; max_steps - ограничение количества шагов каждого ядра.
+        Возвращает список количества выполненных шагов по ядрам'''
+        if quantum < 1:
+            raise RuntimeError('Некорректный квант %d.' % quantum)
+        steps = [0] * len(self.cores)
+        live = [idx for idx, core in enumerate(self.cores) if not core.proc.halt]
+        while live:
+            for idx in live:
+                core = self.cores[idx]
+                proc, execute = core.proc, core.execute_cmd
+                count = quantum if max_steps is None else min(quantum, max_steps - steps[idx])
+                done = 0
+                try:
+                    while done < count and not proc.halt:
+                        execute()
+                        done += 1
+                except RuntimeError as err:
+                    raise RuntimeError('Ядро %d: %s' % (idx, err.args[0]))
+                finally:
+                    steps[idx] += done
+                if max_steps is not None and steps[idx] >= max_steps and not proc.halt:
+                    raise RuntimeError('Ядро %d: Превышено максимальное количество шагов (%d).' % (idx, max_steps))
+            live = [idx for idx in live if not self.cores[idx].proc.halt]
+        return steps
+
+    def run_parallel(self, max_steps=None, timeout=None):
+        '''параллельное выполнение ядер в отдельных процессах над общей памятью данных (по завершении
+        память копируется обратно в self.dmem); timeout - ограничение времени в секундах.
+        Возвращает список количества выполненных шагов по ядрам'''
+        from multiprocessing import shared_memory  # python 3.8+, нужен только в этом режиме
+        size = len(self.dmem)
+        shm = shared_memory.SharedMemory(create=True, size=max(4 * size, 1))
+        try:
+            shm.buf[:4 * size] = self.dmem.tobytes()
+            lock = multiprocessing.Lock()
+            results = multiprocessing.Queue()
+            workers = [multiprocessing.Process(target=run_core, args=(
+                self.program, shm.name, size, self.profile, idx, len(self.cores), [int(v) for v in core.proc.reg],
+                core.proc.pc, core.proc.halt, lock, results, max_steps)) for idx, core in enumerate(self.cores)]
+            for worker in workers:
+                worker.start()
+            try:
+                finished = self.collect(workers, results, timeout)  # до join: очередь не переполняется
+            finally:
+                for worker in workers:
+                    if worker.is_alive():
+                        worker.terminate()
+                    worker.join()
+            self.dmem[:] = array('i', bytes(shm.buf[:4 * size]))
+        finally:
+            shm.close()
+            shm.unlink()
+        steps = [0] * len(self.cores)
+        errors = []
+        for idx, count, reg, pc, halt, output, error in finished:
+            proc = self.cores[idx].proc
+            proc.reg[:] = array('i', reg)
+            proc.pc, proc.halt, steps[idx] = pc, halt, count
+            self.outputs[idx][:] = output
+            if error is not None:
+                errors.append('Ядро %d: %s' % (idx, error))
+        if errors:
+            raise RuntimeError(str.join('\n', errors))
+        return steps
+
+
+    def collect(self, workers, results, timeout=None):
+        '''получение результатов ядер из очереди results с проверкой, что процессы workers живы;
+        timeout - ограничение времени всего выполнения. Возвращает результаты по порядку ядер'''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        finished = {}
+        lost = set()  # ядра, процесс которых завершился, а результат еще не получен
+        while len(finished) < len(workers):
+            try:
+                result = results.get(timeout=0.05)
+                finished[result[0]] = result
+                continue
+            except queue.Empty:
+                pass
+            for idx, worker in enumerate(workers):
+                if idx in finished or worker.exitcode is None:
+                    continue
+                if idx in lost:  # результата нет и после повторного ожидания очереди
+                    proc = self.cores[idx].proc
+                    finished[idx] = (idx, 0, list(proc.reg), proc.pc, proc.halt, [],
+                                     'Процесс ядра завершился без результата (код %d).' % worker.exitcode)
+                lost.add(idx)
+            if deadline is not None and time.monotonic() > deadline:
+                raise RuntimeError('Превышено время выполнения ядер (%s с).' % timeout)
+        return [finished[idx] for idx in range(len(workers))]
+
+
+def run_core(program, name, size, profile, idx, count, reg, pc, halt, lock, results, max_steps):
+    '''выполнение ядра idx в отдельном процессе над общей памятью name из size ячеек; результат
+    (номер ядра, шаги, регистры, pc, флаг останова, выведенные значения, ошибка) передается в очередь results
+    при любом завершении. Ввода у ядер нет: команда IN завершается ошибкой'''
+    from multiprocessing import shared_memory
+    output = []
+    steps, error, state = 0, None, (reg, pc, halt)
+    shm = buf = view = None
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+        buf = shm.buf[:4 * size]
+        view = buf.cast('i')  # ячейки общей памяти (array не может работать с чужим буфером)
+        cpu = CmdProcessor(program, storage='array', output=output, profile=profile, input=())
+        cpu.proc.dmem = view
+        cpu.decode_cmem()  # проверка прямых адресов по общей памяти данных
+        cpu.lock = lock
+        cpu.proc.reg[:] = array('i', reg)
+        cpu.proc.pc, cpu.proc.halt = pc, halt
+        try:
+            steps = cpu.run(trace=None, max_steps=max_steps)
+        finally:
+            state = (list(cpu.proc.reg), cpu.proc.pc, cpu.proc.halt)
+    except RuntimeError as err:
+        error = err.args[0]
+    except BaseException as err:  # родитель ждет результат каждого ядра, поэтому передается любая ошибка
+        error = '%s: %s' % (type(err).__name__, err)
+    finally:
+        results.put((idx, steps) + state + (output, error))
+        for obj in (view, buf):
+            if obj is not None:
+                obj.release()
+        if shm is not None:
+            shm.close()
+
+
+def reduction_source(profile=None):
+    '''параллельное суммирование массива (раскладка памяти как в asm1.txt: mem[0] - сумма, mem[1] - длина,
+    mem[2]... - элементы): ядро суммирует каждый n-й элемент, начиная со своего номера, и атомарно
+    добавляет частичную сумму к mem[0] циклом CAS'''
+    profile = profile if profile is not None else MachineProfile()
+    core, cores = profile.registers - 1, profile.registers - 2
+    return ['.code  # секция программы (параллельная сумма элементов массива)',
+            '       mov RI 1 0   # reg[1] : частичная сумма ядра',
+            '       mov RM 2 1   # reg[2] = mem[1] : длина массива',
+            '       add RI 2 2   # reg[2] : адрес конца массива',
+            '       mov RR 3 %d   # reg[3] : номер ядра' % core,
+            '       add RI 3 2   # reg[3] : адрес первого элемента ядра',
+            '       cmp RR 2 3',
+            '       jg  loop',
+            '       jmp merge    # у ядра нет элементов',
+            'loop:  add RX 1 3   # reg[1] = reg[1] + mem[reg[3]]',
+            '       add RR 3 %d   # следующий элемент ядра - через количество ядер' % cores,
+            '       cmp RR 2 3',
+            '       jg  loop',
+            'merge: mov RM 0 0   # reg[0] : ожидаемое значение суммы mem[0]',
+            '       mov RR 4 0',
+            '       add RR 4 1   # reg[4] : новое значение суммы',
+            '       cas MR 0 4   # mem[0] = reg[4], если mem[0] не изменилась',
+            '       je  done',
+            '       jmp merge    # сумму изменило другое ядро - повтор',
+            'done:  fence',
+            '       out R 1      # вывод частичной суммы',
+            '       halt']
+
+
+def reduction_machine(values, cores):
+    '''машина с cores ядрами и программой параллельного суммирования массива values'''
+    profile = MachineProfile(dmem_size=len(values) + 2)
+    machine = SmpMachine(cores, profile)
+    machine.parse_source(reduction_source(profile))
+    machine.init_dmem([0, len(values)] + list(values))
+    return machine
+
+
+def check_reduction(size=1000, cores=(1, 2, 3, 4, 8), quanta=(1, 2, 3, 7, 100), seed=0):
+    '''проверка суммы в детерминированном режиме для всех сочетаний количества ядер и кванта (в т.ч.
+    повторяемость шагов при повторном запуске), возвращает список расхождений'''
+    rng = random.Random(seed)
+    values = [rng.randrange(-1000, 1000) for idx in range(size)]
+    errors = []
+    for ncores in cores:
+        for quantum in quanta:
+            machine = reduction_machine(values, ncores)
+            steps = machine.run(quantum)
+            if machine.dmem[0] != sum(values) or sum(map(sum, machine.outputs)) != sum(values):
+                errors.append('ядер %d, квант %d: сумма %d вместо %d' % (ncores, quantum, machine.dmem[0], sum(values)))
+            machine.init_dmem([0, size] + values)
+            if machine.run(quantum) != steps:
+                errors.append('ядер %d, квант %d: количество шагов не повторяется' % (ncores, quantum))
+    return errors
+
+
+def bench_reduction(size=200000, cores=(1, 2, 4), quantum=100, seed=0):
+    '''замер параллельного суммирования массива из size элементов: время детерминированного и параллельного
+    режимов и ускорение параллельного режима относительно одного ядра, генератор строк таблицы'''
+    rng = random.Random(seed)
+    values = [rng.randrange(-1000, 1000) for idx in range(size)]
+    base = None
+    for ncores in cores:
+        machine = reduction_machine(values, ncores)
+        start = time.perf_counter()
+        machine.run(quantum)
+        interleaved = time.perf_counter() - start
+        machine = reduction_machine(values, ncores)
+        start = time.perf_counter()
+        steps = machine.run_parallel()
+        parallel = time.perf_counter() - start
+        if machine.dmem[0] != sum(values):
+            raise RuntimeError('Неверная сумма при %d ядрах: %d вместо %d.' % (ncores, machine.dmem[0], sum(values)))
+        base = parallel if base is None else base
+        yield '%5d %12d %12.3f %12.3f %9.2f' % (ncores, sum(steps), interleaved, parallel, base / parallel)
+
+
+if __name__ == '__main__':  # точка входа в программу
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    cores = [int(arg) for arg in sys.argv[2:]] or [1, 2, 4]
+    try:
+        errors = check_reduction()
+        print('Проверка детерминированного режима: %s' % ('расхождений нет' if not errors else str.join('; ', errors)))
+        print('Процессоров ОС: %d' % multiprocessing.cpu_count())
+        print('%5s %12s %12s %12s %9s' % ('ядер', 'шагов', 'поочер., с', 'паралл., с', 'ускорение'))
+        for line in bench_reduction(size, cores):
+            print(line)
+    except RuntimeError as err:
+        print(err.args[0])
+        sys.exit(1)
@@ -0,0 +1,77 @@
+# Написано на python 3.7
+# Проверка снимков состояния, restore и fork (копирования страниц при записи) на случайных программах
+# Запуск: python snapcheck.py [количество программ]
+import sys  # библиотека, необходимая для обработки параметров командной строки
+import random
+from emulator import CmdProcessor, wrap_int
+from jit import BlockCmdProcessor, random_program, run_state
+from profiler import Profiler
+from debugger import ReverseDebugger
+
+
+def live_bytes(proc):
+    '''текущая память данных процессора proc в формате страниц снимка'''
+    return proc.cells_to_bytes(proc.dmem[:] if proc.storage == 'array' else proc.dmem)
+
+
+def snapshot_check(count=200, seed=0, max_steps=500):
+    '''проверка снимков состояния на count случайных программах: учет измененных страниц не теряется при
+    включении и выключении профилировщика, снимок и fork совпадают с текущим состоянием, restore возвращает
+    состояние снимка, отмена шагов отладчиком, включенным до первого снимка, отмечает страницы измененными,
+    копия fork и исходный обработчик продолжают выполнение одинаково, не изменяя общих страниц снимка;
+    возвращает список несовпадений (seed программы, хранилище, проверка)'''
+    failures = []
+    for idx in range(count):
+        rng = random.Random(seed + idx)
+        prog, data = random_program(rng, length=rng.randrange(2, 40))
+        for storage in ('bytes', 'array'):
+            cpu = CmdProcessor(prog, data, storage=storage, output=[])
+            profiler = Profiler(cpu)
+            profiler.enable()
+            first = cpu.snapshot()
+            profiler.disable()  # восстанавливает write_value, сохраненный до включения учета страниц
+            state = run_state(cpu, max_steps)
+            snap = cpu.snapshot()
+            proc = cpu.proc
+            if bytes().join(snap.pages) != live_bytes(proc):
+                failures.append((seed + idx, storage, 'snapshot'))
+            clone = cpu.fork(snap)
+            if (clone.proc.pc, clone.proc.halt, clone.proc.values(clone.proc.reg),
+                    clone.proc.values(clone.proc.dmem)) != state[2:]:
+                failures.append((seed + idx, storage, 'fork'))
+            cpu.restore(first)
+            if proc.values(proc.dmem) != [wrap_int(value) for value in data] or proc.pc != 0:
+                failures.append((seed + idx, storage, 'restore'))
+            cpu = CmdProcessor(prog, data, storage=storage, output=[])
+            debugger = ReverseDebugger(cpu)
+            debugger.enable()  # запись отмены захвачена до включения учета страниц
+            try:
+                debugger.run(max_steps)
+            except (RuntimeError, IndexError):
+                pass
+            cpu.snapshot()
+            debugger.step_back(max_steps)
+            snap = cpu.snapshot()
+            if bytes().join(snap.pages) != live_bytes(cpu.proc):
+                failures.append((seed + idx, storage, 'step_back'))
+            for cpu_class in (CmdProcessor, BlockCmdProcessor):
+                cpu = cpu_class(prog, data, storage=storage, output=[])
+                run_state(cpu, rng.randrange(1, 50))  # начало выполнения до снимка
+                snap = cpu.snapshot()
+                image = snap.to_bytes()
+                clone = cpu.fork(snap)
+                if run_state(clone, max_steps) != run_state(cpu, max_steps):
+                    failures.append((seed + idx, storage, 'fork run %s' % cpu_class.__name__))
+                if snap.to_bytes() != image or bytes().join(clone.snapshot().pages) != live_bytes(clone.proc):
+                    failures.append((seed + idx, storage, 'fork pages %s' % cpu_class.__name__))
+                clone.restore(snap)
+                if live_bytes(clone.proc) != bytes().join(snap.pages):
+                    failures.append((seed + idx, storage, 'fork restore %s' % cpu_class.__name__))
+    return failures
+
+
+if __name__ == '__main__':  # точка входа в программу
+    failures = snapshot_check(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
+    print('Проверка снимков состояния: несовпадений %d' % len(failures))
+    for failure in failures[:5]:
+        print(failure)
@@ -0,0 +1,225 @@
+# Написано на python 3.7
+# Пакетное выполнение одной программы над множеством наборов данных (NumPy)
+import sys  # библиотека, необходимая для обработки параметров командной строки
+import time
+import random
+from emulator import CmdProcessor, wrap_int
+try:
+    import numpy as np
+except ImportError:  # numpy нужен только для пакетного выполнения
+    np = None
+
+
+class BatchCmdProcessor(object):
+    '''пакетный обработчик команд: одна программа выполняется синхронно над N наборами данных (дорожками)
+
+    Регистры и память данных - массивы NumPy формы (N, размер), у каждой дорожки свои pc, флаг останова
+    и счетчик шагов. Дорожки с одинаковым pc выполняют команду одной векторной операцией, поэтому
+    расхождение ветвлений je/jg обрабатывается масками. Ошибка в дорожке (выход за границы памяти,
+    некорректная команда, лимит шагов) останавливает только эту дорожку.
+    '''
+    def __init__(self, program=None, profile=None):
+        if np is None:
+            raise RuntimeError('Для пакетного выполнения требуется библиотека numpy.')
+        self.cpu = CmdProcessor(program, profile=profile)  # скалярный обработчик для ассемблирования и декодирования
+        self.data = None  # память данных из секции .data исходного файла
+        self.decode()
+
+    def open_asm_file(self, filename):
+        '''чтение и ассемблирование asm кода из файла (однократно для всех наборов данных)'''
+        asmprogram, mashprog = self.cpu.open_asm_file(filename)
+        self.data = self.cpu.proc.values(self.cpu.proc.dmem)
+        self.decode()
+        return asmprogram, mashprog
+
+    def assemble(self, asmprog, code_section_start_idx=0):
+        '''перевод программы на языке ассемблера в машинные коды'''
+        prog = self.cpu.assemble(asmprog, code_section_start_idx)
+        self.decode()
+        return prog
+
+    def decode(self):
+        '''декодирование памяти команд в список (имя команды, тип операнда1, операнд1, тип операнда2, операнд2,
+        к-во слов команды)'''
+        self.code = []
+        for addr in range(len(self.cpu.proc.cmem)):
+            fields = self.cpu.fetch(addr)
+            if fields is None or fields[0] not in self.cpu.kops:
+                self.code.append((None, 0, 0, 0, 0, 1))
+                continue
+            self.code.append((self.cpu.kops[fields[0]][0],) + fields[1:])
+
+    def init_dmem(self, datasets):
+        '''запись N наборов данных (памяти дорожек могут быть разной длины)'''
+        count = len(datasets)
+        self.size = np.array([len(data) + self.cpu.proc.dmem_padding(len(data)) for data in datasets],
+                             dtype=np.int64)  # размеры памяти дорожек (с дополнением до размера профиля)
+        self.dmem = np.zeros((count, max(self.size.max(initial=0), 1)), dtype=np.int64)
+        for lane, data in enumerate(datasets):
+            self.dmem[lane, :len(data)] = [wrap_int(value) for value in data]
+        self.reg = np.zeros((count, len(self.cpu.proc.reg)), dtype=np.int64)
+        self.pc = np.zeros(count, dtype=np.int64)
+        self.halt = np.zeros(count, dtype=bool)
+        self.failed = np.zeros(count, dtype=bool)
+        self.steps = np.zeros(count, dtype=np.int64)
+        self.errors = [None] * count  # сообщения об ошибках дорожек
+        self.outputs = [[] for lane in range(count)]  # значения команды OUT по дорожкам
+
+    def memories(self):
+        '''итоговая память данных каждой дорожки в виде списков python int'''
+        return [self.dmem[lane, :self.size[lane]].tolist() for lane in range(len(self.size))]
+
+    def wrap(self, values):
+        '''усечение значений до 32-битных знаковых'''
+        return ((values + 0x80000000) & 0xffffffff) - 0x80000000
+
+    def fail(self, lanes, message):
+        '''останов дорожек lanes с ошибкой message'''
+        self.failed[lanes] = True
+        for lane in lanes.tolist():
+            self.errors[lane] = message
+
+    def address(self, lanes, optype, op, ok):
+        '''адреса памяти данных операнда op типа optype для дорожек lanes, ошибочные дорожки снимаются в ok'''
+        if optype == 0b01 or optype == 0b11:
+            if op >= self.reg.shape[1]:
+                ok[:] = False
+                return None
+        if optype == 0b10:
+            addr = np.full(len(lanes), op, dtype=np.int64)
+        elif optype == 0b11:
+            addr = self.reg[lanes, op]
+        else:
+            return None
+        size = self.size[lanes]
+        ok &= (addr >= 0) & (addr < size)
+        return np.where(ok, addr, 0)  # адрес остановленных дорожек не используется
+
+    def read(self, lanes, optype, op, addr):
+        '''чтение значений операнда op типа адресации optype для дорожек lanes'''
+        if optype == 0b00:
+            return np.full(len(lanes), op, dtype=np.int64)
+        if optype == 0b01:
+            return self.reg[lanes, op]
+        return self.dmem[lanes, addr]
+
+    def write(self, lanes, optype, op, addr, values):
+        '''запись значений values в приемник op типа адресации optype для дорожек lanes'''
+        if optype == 0b01:
+            self.reg[lanes, op] = self.wrap(values)
+        else:
+            self.dmem[lanes, addr] = self.wrap(values)
+
+    def execute(self, pc, lanes):
+        '''выполнение команды по адресу pc для дорожек lanes'''
+        if pc < 0 or pc >= len(self.code):
+            self.fail(lanes, 'Выход за границы памяти команд (pc = %d).' % pc)
+            return
+        name, optype1, op1, optype2, op2, size = self.code[pc]
+        if name is None:
+            self.fail(lanes, 'Некорректный код команды (pc = %d).' % pc)
+            return
+        if name in ('IN', 'CAS', 'FENCE'):
+            self.fail(lanes, 'Команда %s не поддерживается при пакетном выполнении (pc = %d).' % (name, pc))
+            return
+        if name in ('MOV', 'ADD', 'SUB', 'AND', 'OR', 'XOR', 'NOT') and optype1 == 0b00:
+            self.fail(lanes, 'Некорректный тип адресации операнда')
+            return
+        ok = np.ones(len(lanes), dtype=bool)
+        addr1 = addr2 = None
+        if name not in ('NOP', 'HALT'):
+            addr1 = self.address(lanes, optype1, op1, ok)
+        if name in ('MOV', 'ADD', 'SUB', 'AND', 'OR', 'XOR', 'CMP'):
+            addr2 = self.address(lanes, optype2, op2, ok)
+        if not ok.all():  # дорожки с выходом за границы памяти останавливаются
+            self.fail(lanes[~ok], 'Выход за границы памяти данных (pc = %d).' % pc)
+            lanes = lanes[ok]
+            addr1 = None if addr1 is None else addr1[ok]
+            addr2 = None if addr2 is None else addr2[ok]
+            if len(lanes) == 0:
+                return
+        if name == 'MOV':
+            self.write(lanes, optype1, op1, addr1, self.read(lanes, optype2, op2, addr2))
+        elif name in ('ADD', 'SUB', 'AND', 'OR', 'XOR'):
+            value1 = self.read(lanes, optype1, op1, addr1)
+            value2 = self.read(lanes, optype2, op2, addr2)
+            value = (value1 + value2 if name == 'ADD' else value1 - value2 if name == 'SUB' else
+                     value1 & value2 if name == 'AND' else value1 | value2 if name == 'OR' else value1 ^ value2)
+            self.write(lanes, optype1, op1, addr1, value)
+        elif name == 'NOT':
+            self.write(lanes, optype1, op1, addr1, ~self.read(lanes, optype1, op1, addr1))
+        elif name == 'CMP':
+            value1 = self.read(lanes, optype1, op1, addr1)
+            value2 = self.read(lanes, optype2, op2, addr2)
+            self.reg[lanes, 0] = np.where(value1 > value2, 0b10, np.where(value1 < value2, 0b01, 0b00))
+        elif name == 'JMP':
+            self.pc[lanes] = self.read(lanes, optype1, op1, addr1)
+            return
+        elif name in ('JE', 'JG'):
+            taken = self.reg[lanes, 0] == (0b00 if name == 'JE' else 0b10)
+            self.pc[lanes] = np.where(taken, self.read(lanes, optype1, op1, addr1), pc + size)
+            return
+        elif name == 'OUT':
+            for lane, value in zip(lanes.tolist(), self.read(lanes, optype1, op1, addr1).tolist()):
+                self.outputs[lane].append(value)
+        elif name == 'HALT':
+            self.halt[lanes] = True
+        self.pc[lanes] = pc + size
+
+    def run(self, datasets=None, max_steps=None):
+        '''выполнение программы над наборами данных datasets (по умолчанию - секция .data исходного файла),
+        возвращает значения команды OUT по дорожкам'''
+        if datasets is None:
+            datasets = [self.data if self.data is not None else self.cpu.proc.values(self.cpu.proc.dmem)]
+        self.init_dmem(datasets)
+        while True:
+            active = ~(self.halt | self.failed)
+            if max_steps is not None:
+                over = active & (self.steps >= max_steps)
+                if over.any():
+                    self.fail(np.flatnonzero(over), 'Превышено максимальное количество шагов (%d).' % max_steps)
+                    active &= ~over
+            lanes = np.flatnonzero(active)
+            if len(lanes) == 0:
+                break
+            pcs = self.pc[lanes]
+            first = int(pcs[0])
+            if (pcs == first).all():  # все дорожки на одной команде
+                self.execute(first, lanes)
+            else:  # расхождение ветвлений - команда выполняется для каждой группы дорожек отдельно
+                for pc in np.unique(pcs).tolist():
+                    self.execute(pc, lanes[pcs == pc])
+            self.steps[lanes] += 1
+        return self.outputs
+
+
+def bench_batch(filename, count, length=10, seed=0):
+    '''сравнение пакетного выполнения с последовательными запусками скалярного эмулятора'''
+    rng = random.Random(seed)
+    datasets = [[0, length] + [rng.randrange(-1000, 1000) for idx in range(length)] for lane in range(count)]
+    batch = BatchCmdProcessor()
+    batch.open_asm_file(filename)
+    start = time.perf_counter()
+    outputs = batch.run(datasets)
+    batch_time = time.perf_counter() - start
+    results = []  # результаты скалярного выполнения (значения OUT, память данных)
+    start = time.perf_counter()
+    for data in datasets:
+        out = []
+        cpu = CmdProcessor(storage='array', output=out)
+        cpu.open_asm_file(filename)
+        cpu.proc.init_dmem(data)
+        cpu.run(trace=None)
+        results.append((out, cpu.proc.values(cpu.proc.dmem)))
+    scalar_time = time.perf_counter() - start
+    if results != list(zip(outputs, batch.memories())):
+        raise RuntimeError('Результаты пакетного и скалярного выполнения различаются.')
+    return scalar_time, batch_time
+
+
+if __name__ == '__main__':  # точка входа в программу
+    fileName = sys.argv[1] if len(sys.argv) > 1 else 'asm3.txt'
+    for count in (10, 100, 1000, 10000):
+        scalar_time, batch_time = bench_batch(fileName, count)
+        print('%s, %d наборов данных: скалярно %.3f с, пакетно %.3f с (x%.1f)' %
+              (fileName, count, scalar_time, batch_time, scalar_time / batch_time))